@@ -0,0 +1,153 @@
+# This file is part of pylabels, a Python library to create PDFs for printing
+# labels.
+# Copyright (C) 2012, 2013, 2014, 2015 Blair Bonnett
+#
+# pylabels is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# pylabels is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pylabels.  If not, see <http://www.gnu.org/licenses/>.
+
+# Stress test for rendering previews from several threads at once. A sheet with
+# a background image, registered images, shaded missing labels and repeated
+# labels is previewed and rasterised one page at a time, and then every page is
+# rendered many times from a pool of threads. Each concurrent render must match
+# the sequential render of the same page, and the sheet must be unchanged
+# afterwards. The script reports any differences and exits with an error if
+# there are any.
+#
+# The anti-aliasing of ReportLab's renderPM backend is not exactly repeatable,
+# so two renders of the same drawing can differ by a grey level or so along the
+# edges of shapes and text. Previews are therefore compared with a tolerance on
+# the grey level of each pixel, and rasters in the default thresholded mode.
+
+from __future__ import print_function
+
+import argparse
+import io
+import os.path
+import sys
+import threading
+
+# Make sure we test the copy of pylabels this script belongs to.
+base_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(base_path))
+
+import labels
+from PIL import Image, ImageChops
+from reportlab.graphics import shapes
+
+demos_path = os.path.join(os.path.dirname(base_path), 'demos')
+
+
+def create_sheet():
+    """Create the sheet to render. """
+    background = os.path.join(demos_path, 'page_background_1.png')
+    image = os.path.join(demos_path, 'page_background_2.png')
+    specs = labels.Specification(210, 297, 2, 8, 90, 25, corner_radius=2, background_filename=background)
+
+    def draw_label(label, width, height, obj):
+        label.add(shapes.String(2, 2, str(obj), fontName="Helvetica", fontSize=20))
+        label.add(shapes.Circle(width - 15, height / 2.0, 2 + obj % 7))
+        label.add(sheet.images.image(image, 50, 2, 20, 20))
+
+    sheet = labels.Sheet(specs, draw_label, border=True, shade_missing=True)
+    sheet.partial_page(1, ((1, 1), (2, 2)))
+    sheet.partial_page(6, ((8, 2), (7, 1)))
+    sheet.add_labels(range(60))
+    sheet.add_labels([3], count=20)
+    return sheet
+
+
+def grey(data):
+    """Decode a preview to a greyscale image. """
+    return Image.open(io.BytesIO(data)).convert('L')
+
+
+def difference(a, b):
+    """Get the largest difference in grey level between two images. """
+    return ImageChops.difference(a, b).getextrema()[1]
+
+
+def sheet_state(sheet):
+    """Get the parts of the sheet which rendering must not change. """
+    bgimage = sheet._bgimage
+    return (bgimage.width, bgimage.height, sheet._position, sheet._shaded,
+            [len(page.contents) for page in sheet._pages])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stress test concurrent preview rendering.")
+    parser.add_argument('--threads', type=int, default=16,
+                        help="Number of threads to render with.")
+    parser.add_argument('--repeat', type=int, default=20,
+                        help="Number of times each page is rendered concurrently.")
+    parser.add_argument('--dpi', type=int, default=72,
+                        help="Resolution of the renders.")
+    parser.add_argument('--tolerance', type=int, default=1,
+                        help="Largest difference in grey level allowed between concurrent and sequential previews.")
+    args = parser.parse_args()
+
+    sheet = create_sheet()
+    pages = list(range(1, sheet.page_count + 1))
+    before = sheet_state(sheet)
+
+    # Render each page one at a time.
+    previews = dict((page, grey(sheet.preview_string(page, dpi=args.dpi))) for page in pages)
+    rasters = dict((page, data) for page, width, height, data in sheet.raster(dpi=args.dpi))
+
+    # Then render them all many times from a pool of threads, alternating
+    # between previews and rasters.
+    jobs = [(page, kind) for i in range(args.repeat) for page in pages for kind in ('preview', 'raster')]
+    lock = threading.Lock()
+    problems = []
+    worst = [0]
+
+    def worker():
+        while True:
+            with lock:
+                if not jobs:
+                    return
+                page, kind = jobs.pop()
+            try:
+                if kind == 'preview':
+                    diff = difference(grey(sheet.preview_string(page, dpi=args.dpi)), previews[page])
+                    with lock:
+                        worst[0] = max(worst[0], diff)
+                    if diff > args.tolerance:
+                        problems.append("Preview of page {0:d} differs by {1:d} grey levels.".format(page, diff))
+                else:
+                    data = next(sheet.raster(dpi=args.dpi, pages=[page]))[3]
+                    if data != rasters[page]:
+                        problems.append("Raster of page {0:d} differs.".format(page))
+            except Exception as e:
+                problems.append("Rendering page {0:d} failed: {1!r}".format(page, e))
+
+    total = len(jobs)
+    threads = [threading.Thread(target=worker) for i in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Rendering must not have changed the sheet.
+    if sheet_state(sheet) != before:
+        problems.append("The sheet was changed by rendering.")
+
+    # Output.
+    print("{0:d} renders of {1:d} pages from {2:d} threads; largest preview difference {3:d} grey level(s).".format(
+        total, len(pages), args.threads, worst[0]))
+    for problem in problems:
+        print(problem, file=sys.stderr)
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,303 @@
+# This file is part of pylabels, a Python library to create PDFs for printing
+# labels.
+# Copyright (C) 2012, 2013, 2014, 2015 Blair Bonnett
+#
+# pylabels is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# pylabels is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pylabels.  If not, see <http://www.gnu.org/licenses/>.
+
+# Benchmarks for pylabels. Each scenario is based on one of the demo scripts,
+# scaled up to give measurable timings. For each scenario the time taken to add
+# the labels, save the PDF and render a preview is measured, along with the
+# peak memory used and the size of the PDF. The time taken to check a
+# specification and to import pylabels are measured separately. Importing
+# pylabels must not load the ReportLab rendering modules; if it does, the
+# script reports this and exits with an error.
+#
+# The results are compared to those stored in baseline.json (if it exists).
+# Run with --save-baseline to replace the stored baseline with the results of
+# this run. Note that the baseline is only meaningful on the machine it was
+# recorded on.
+
+from __future__ import print_function
+
+import argparse
+import gc
+import io
+import json
+import os.path
+import random
+import subprocess
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# Make sure we benchmark the copy of pylabels this script belongs to.
+base_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(base_path))
+
+import labels
+from reportlab.graphics import shapes
+from reportlab.graphics.widgets.grids import Grid
+from reportlab.lib import colors
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfbase.pdfmetrics import registerFont
+
+demos_path = os.path.join(os.path.dirname(base_path), 'demos')
+baseline_filename = os.path.join(base_path, 'baseline.json')
+clock = getattr(time, 'perf_counter', time.time)
+
+
+# Drawing functions used by the scenarios.
+def draw_text(label, width, height, obj):
+    label.add(shapes.String(2, 2, str(obj), fontName="Helvetica", fontSize=40))
+
+
+def draw_background(label, width, height, obj):
+    colour = random.choice((colors.HexColor(0x04F1B1), colors.Color(0.5, 0.1, 0.7)))
+    g = Grid()
+    g.width = width
+    g.height = height
+    g.delta = width/14.0
+    g.delta0 = random.random() * (width/14.0)
+    g.fillColor = None
+    g.strokeColor = None
+    g.orientation = 'vertical'
+    g.stripeColors = (colors.HexColor(0xFFFFFF), colour)
+    label.add(g)
+    label.add(shapes.String(2, 2, str(obj), fontName="Helvetica", fontSize=20))
+
+
+def draw_name(label, width, height, name):
+    label.add(shapes.String(5, height-20, "Hello, my name is",
+                            fontName="Judson Bold", fontSize=20))
+    font_size = labels.fit_font_size(name, "KatamotzIkasi", width - 10, max_size=50)
+    s = shapes.String(width/2.0, 15, name, textAnchor="middle")
+    s.fontName = "KatamotzIkasi"
+    s.fontSize = font_size
+    s.fillColor = random.choice((colors.black, colors.blue, colors.red, colors.green))
+    label.add(s)
+
+
+# The scenarios. Each function returns a sheet and a function to add the
+# labels to it.
+def basic(scale):
+    specs = labels.Specification(210, 297, 2, 8, 90, 25, corner_radius=2)
+    sheet = labels.Sheet(specs, draw_text, border=True)
+    return sheet, lambda: sheet.add_labels(range(160 * scale))
+
+
+def repeated(scale):
+    specs = labels.Specification(210, 297, 2, 8, 90, 25, corner_radius=2)
+    sheet = labels.Sheet(specs, draw_text, border=True)
+    return sheet, lambda: sheet.add_labels(range(10), count=1000 * scale)
+
+
+def partial_pages(scale):
+    specs = labels.Specification(210, 297, 2, 8, 90, 25, corner_radius=2)
+    sheet = labels.Sheet(specs, draw_text, border=True, shade_missing=True)
+    for page in range(1, 10 * scale + 1):
+        sheet.partial_page(page, ((1, 1), (2, 2), (4, 2)))
+    return sheet, lambda: sheet.add_labels(range(160 * scale))
+
+
+def padding(scale):
+    specs = labels.Specification(210, 297, 2, 8, 90, 25, corner_radius=2,
+                                 left_padding=5, top_padding=5, bottom_padding=5, right_padding=10,
+                                 padding_radius=4)
+    sheet = labels.Sheet(specs, draw_background, border=True)
+    return sheet, lambda: sheet.add_labels(range(160 * scale))
+
+
+def page_background(scale):
+    filename = os.path.join(demos_path, "page_background_1.png")
+    specs = labels.Specification(210, 297, 2, 8, 90, 25, corner_radius=2, background_filename=filename)
+    sheet = labels.Sheet(specs, draw_text, border=True)
+    return sheet, lambda: sheet.add_labels(range(160 * scale))
+
+
+def nametags(scale):
+    registerFont(TTFont('Judson Bold', os.path.join(demos_path, 'Judson-Bold.ttf')))
+    registerFont(TTFont('KatamotzIkasi', os.path.join(demos_path, 'KatamotzIkasi.ttf')))
+    with open(os.path.join(demos_path, 'names.txt')) as f:
+        names = [name.strip() for name in f]
+    specs = labels.Specification(210, 297, 2, 8, 90, 25, corner_radius=2)
+    sheet = labels.Sheet(specs, draw_name, border=True)
+    return sheet, lambda: sheet.add_labels(names * (3 * scale))
+
+
+scenarios = [basic, repeated, partial_pages, padding, page_background, nametags]
+
+
+def timed(function):
+    """Run a function, returning the time taken and its result. """
+    gc.collect()
+    start = clock()
+    result = function()
+    return clock() - start, result
+
+
+def run_scenario(scenario, scale, repeat):
+    """Run a single scenario and return its results. The best of the repeated
+    timings is used.
+
+    """
+    add_time = save_time = preview_time = None
+    for i in range(repeat):
+        # Add the labels and save.
+        random.seed(187459)
+        sheet, add = scenario(scale)
+        elapsed, _ = timed(add)
+        add_time = min(elapsed, add_time or elapsed)
+        pdf = io.BytesIO()
+        elapsed, _ = timed(lambda: sheet.save(pdf))
+        save_time = min(elapsed, save_time or elapsed)
+
+        # Previews need a working renderPM backend.
+        pages = min(sheet.page_count, 3)
+        try:
+            elapsed, _ = timed(lambda: [sheet.preview_string(page, dpi=72) for page in range(1, pages + 1)])
+        except Exception:
+            pass
+        else:
+            preview_time = min(elapsed, preview_time or elapsed)
+
+    # Tracing memory allocations slows everything down, so measure the peak
+    # memory used by the sheet in a separate run.
+    peak = None
+    if tracemalloc:
+        random.seed(187459)
+        tracemalloc.start()
+        memory_sheet, add = scenario(scale)
+        add()
+        memory_sheet.save(io.BytesIO())
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return {
+        'labels': sheet.label_count,
+        'pages': sheet.page_count,
+        'add_labels_per_sec': sheet.label_count / add_time,
+        'save_pages_per_sec': sheet.page_count / save_time,
+        'preview_pages_per_sec': pages / preview_time if preview_time else None,
+        'peak_memory_bytes': peak,
+        'pdf_bytes': len(pdf.getvalue()),
+    }
+
+
+def run_specification(iterations, repeat):
+    """Measure how quickly a specification can be checked. """
+    specs = labels.Specification(210, 297, 2, 8, 90, 25, corner_radius=2,
+                                 left_padding=5, top_padding=5, bottom_padding=5, right_padding=10,
+                                 padding_radius=4)
+    elapsed = min(timed(lambda: [specs._calculate() for i in range(iterations)])[0] for i in range(repeat))
+    return {'calculate_per_sec': iterations / elapsed}
+
+
+# Modules which should only be loaded when they are first used.
+lazy_modules = ('reportlab.graphics.shapes', 'reportlab.graphics.renderPDF', 'reportlab.graphics.renderPM',
+                'reportlab.pdfgen.canvas', 'PIL')
+
+import_script = """
+import sys, time
+clock = getattr(time, 'perf_counter', time.time)
+start = clock()
+import labels
+elapsed = clock() - start
+print(elapsed)
+print(','.join(m for m in {0!r} if m in sys.modules))
+""".format(lazy_modules)
+
+
+def run_import(repeat):
+    """Measure how long it takes to import pylabels in a fresh interpreter, and
+    check the rendering modules are not loaded by it.
+
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(p for p in (os.path.dirname(base_path), env.get('PYTHONPATH')) if p)
+    best, loaded = None, []
+    for i in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', import_script], env=env)
+        elapsed, modules = output.decode('ascii').splitlines()
+        best = min(float(elapsed), best or float(elapsed))
+        loaded = [m for m in modules.split(',') if m]
+    return {'import_ms': best * 1000}, loaded
+
+
+def compare(results, baseline):
+    """Print the results of this run relative to the baseline. Higher rates,
+    and lower memory and file sizes, are better.
+
+    """
+    for name, values in sorted(results.items()):
+        print(name)
+        old = baseline.get(name, {})
+        for key, value in sorted(values.items()):
+            if value is None or key in ('labels', 'pages'):
+                continue
+            line = "    {0:<24s} {1:14.1f}".format(key, value)
+            if old.get(key):
+                line += "  ({0:+.1f}% vs baseline)".format(100.0 * (value - old[key]) / old[key])
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pylabels.")
+    parser.add_argument('--scale', type=int, default=1,
+                        help="Multiplier for the number of labels in each scenario.")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="Number of times to repeat each timing; the best is reported.")
+    parser.add_argument('--scenario', action='append', choices=[s.__name__ for s in scenarios],
+                        help="Only run the given scenario. Can be repeated.")
+    parser.add_argument('--save-baseline', action='store_true',
+                        help="Store the results of this run as the new baseline.")
+    parser.add_argument('--json', action='store_true',
+                        help="Print the results as JSON instead of comparing them to the baseline.")
+    args = parser.parse_args()
+
+    # Run the benchmarks.
+    results = {}
+    for scenario in scenarios:
+        if args.scenario and scenario.__name__ not in args.scenario:
+            continue
+        results[scenario.__name__] = run_scenario(scenario, args.scale, args.repeat)
+    results['specification'] = run_specification(1000 * args.scale, args.repeat)
+    results['import'], loaded = run_import(args.repeat)
+
+    # Output.
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        baseline = {}
+        if os.path.exists(baseline_filename):
+            with open(baseline_filename) as f:
+                baseline = json.load(f)
+        compare(results, baseline)
+
+    # Save the baseline if requested.
+    if args.save_baseline:
+        with open(baseline_filename, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+    # Guard against slow imports creeping back in.
+    if loaded:
+        print("Importing pylabels loaded: {0}".format(', '.join(loaded)), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
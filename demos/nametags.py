@@ -17,7 +17,7 @@
 import labels
 import os.path
 from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.pdfbase.pdfmetrics import registerFont, stringWidth
+from reportlab.pdfbase.pdfmetrics import registerFont
 from reportlab.graphics import shapes
 from reportlab.lib import colors
 import random
@@ -43,13 +43,10 @@ def write_name(label, width, height, name):
     label.add(shapes.String(5, height-20, "Hello, my name is",
                             fontName="Judson Bold", fontSize=20))
 
-    # Measure the width of the name and shrink the font size until it fits.
-    font_size = 50
-    text_width = width - 10
-    name_width = stringWidth(name, "KatamotzIkasi", font_size)
-    while name_width > text_width:
-        font_size *= 0.8
-        name_width = stringWidth(name, "KatamotzIkasi", font_size)
+    # Find the largest font size (up to 50 points) at which the name fits in
+    # the width of the label, leaving 5 points either side. The sizes are
+    # remembered, so names which appear more than once are only measured once.
+    font_size = labels.fit_font_size(name, "KatamotzIkasi", width - 10, max_size=50)
 
     # Write out the name in the centre of the label with a random colour.
     s = shapes.String(width/2.0, 15, name, textAnchor="middle")
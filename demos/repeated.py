@@ -62,6 +62,11 @@ sheet.add_labels(range(15, 22), count=range(1, 100))
 # are skipped (note that 'Three' does not appear in the output).
 sheet.add_labels(['One', 'Two', 'Three'], count=[3,2])
 
+# Runs of consecutive identical objects can be collapsed so the drawing
+# function is only called once for each run. Here 'Four' is only drawn once
+# but appears three times.
+sheet.add_labels(['Four', 'Four', 'Four', 'Five'], collapse=True)
+
 # Any oversize label is automatically trimmed to prevent it messing up others.
 sheet.add_label("Oversized label here")
 
@@ -14,5 +14,13 @@
 # You should have received a copy of the GNU General Public License along with
 # pylabels.  If not, see <http://www.gnu.org/licenses/>.
 
-from .sheet import Sheet
+from .sheet import Sheet, save_merged
 from .specifications import Specification, InvalidDimension
+from .instrumentation import Instrumentation
+from .cache import LabelCache
+from .images import ImageRegistry
+from .used import UsedLabels
+from .context import LabelContext
+from .progress import CancellationToken, Cancelled, ProgressReporter
+from .text import text_width, fit_font_size, wrap_text, fit_text
+from .job import Job
@@ -0,0 +1,239 @@
+# This file is part of pylabels, a Python library to create PDFs for printing
+# labels.
+# Copyright (C) 2012, 2013, 2014, 2015 Blair Bonnett
+#
+# pylabels is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# pylabels is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pylabels.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import os
+
+
+class LabelCache(object):
+    """Persistent cache of label drawings, stored in a directory on disk.
+
+    When a sheet is given a cache, the drawing for each label is looked up
+    before the drawing function is called. On a miss the drawing function is
+    called as normal and the completed label is stored in the cache for future
+    runs. Entries are keyed by a hash of the object's cache key, the drawing
+    function and its version, and the geometry of the label, so changing any of
+    these means the old entries are no longer used.
+
+    The drawing function is identified by its module and qualified name. A
+    lambda or a function defined inside another function cannot be told apart
+    from others with the same name, and a closure can draw differently
+    depending on the values it captured, so these can only be cached if a
+    version is given which identifies them.
+
+    The total size of the cache is bounded; once it is exceeded, the least
+    recently used entries are removed. Several processes can share the same
+    cache directory, although each only keeps track of the entries it knows
+    about when enforcing the size limit.
+
+    Notes
+    -----
+    The drawings are stored with the pickle module, so everything the drawing
+    function adds to the labels must be picklable. Labels which cannot be
+    pickled are simply not cached. Only use a cache directory which you trust,
+    as loading a pickle can run arbitrary code.
+
+    """
+    def __init__(self, directory, max_size=100*1024*1024, version=None):
+        """
+        Parameters
+        ----------
+        directory: path
+            The directory to store the cache in. It is created if needed.
+        max_size: positive integer, default 100MiB
+            The maximum total size of the cache entries in bytes.
+        version: string, default None
+            The version of the drawing function. Change this whenever the
+            output of the drawing function changes to avoid using old entries.
+            This is required for a lambda or closure drawing function.
+
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        # Find the existing entries and when they were last used.
+        self._entries = {}
+        for dirpath, dirnames, filenames in os.walk(directory):
+            for filename in filenames:
+                if filename.endswith('.pkl'):
+                    path = os.path.join(dirpath, filename)
+                    stat = os.stat(path)
+                    self._entries[path] = [stat.st_mtime, stat.st_size]
+        self.size = sum(size for mtime, size in self._entries.values())
+        self._evict()
+
+    def check(self, drawing_callable):
+        """Check the labels from a drawing function can be cached.
+
+        Parameters
+        ----------
+        drawing_callable: callable
+            The drawing function.
+
+        Raises
+        ------
+        ValueError:
+            If the drawing function is a lambda or closure and the cache has no
+            version.
+
+        """
+        if self.version is not None:
+            return
+        name = getattr(drawing_callable, '__qualname__', getattr(drawing_callable, '__name__', ''))
+        if '<' in name or getattr(drawing_callable, '__closure__', None):
+            raise ValueError("The drawing function {0} is a lambda or closure; give the cache a version "
+                             "to identify it.".format(name))
+
+    def key(self, drawing_callable, geometry, obj_key):
+        """Calculate the key of a cache entry.
+
+        Parameters
+        ----------
+        drawing_callable: callable
+            The drawing function.
+        geometry: tuple
+            The values describing the size and style of the label.
+        obj_key: string
+            The key for the object being drawn.
+
+        Returns
+        -------
+        The key as a hexadecimal string.
+
+        Raises
+        ------
+        ValueError:
+            If the drawing function cannot be cached; see the check() method.
+
+        """
+        self.check(drawing_callable)
+        default = getattr(drawing_callable, '__name__', type(drawing_callable).__name__)
+        name = '{0}.{1}'.format(getattr(drawing_callable, '__module__', ''),
+                                getattr(drawing_callable, '__qualname__', default))
+        h = hashlib.sha1()
+        for part in (name, self.version, geometry, obj_key):
+            h.update(repr(part).encode('utf-8'))
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.pkl')
+
+    def get(self, key):
+        """Get a drawing from the cache.
+
+        Returns
+        -------
+        The drawing, or None if it is not in the cache.
+
+        """
+        import pickle
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                drawing = pickle.load(f)
+        except (IOError, OSError):
+            self.misses += 1
+            return None
+        except Exception:
+            # A corrupt entry; remove it so it gets replaced.
+            self._remove(path)
+            self.misses += 1
+            return None
+
+        # Mark the entry as recently used.
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        entry = self._entries.get(path)
+        if entry is None:
+            entry = self._entries[path] = [0, os.path.getsize(path)]
+            self.size += entry[1]
+        entry[0] = os.path.getmtime(path)
+
+        self.hits += 1
+        return drawing
+
+    def put(self, key, drawing):
+        """Store a drawing in the cache, removing the least recently used
+        entries if the cache is too big. Drawings which cannot be pickled are
+        ignored.
+
+        """
+        import pickle
+        import tempfile
+        try:
+            data = pickle.dumps(drawing, pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return
+
+        # Write to a temporary file and move it into place so other processes
+        # never see a partial entry.
+        path = self._path(key)
+        dirname = os.path.dirname(path)
+        if not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                if not os.path.isdir(dirname):
+                    raise
+        fd, tmp = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.rename(tmp, path)
+
+        # Update our record of the size.
+        old = self._entries.get(path)
+        if old:
+            self.size -= old[1]
+        self._entries[path] = [os.path.getmtime(path), len(data)]
+        self.size += len(data)
+
+        # Make sure we are still within the size limit.
+        self._evict()
+
+    def _evict(self):
+        """Remove the least recently used entries until the cache is within
+        its size limit.
+
+        """
+        if self.size > self.max_size:
+            for path in sorted(self._entries, key=lambda p: self._entries[p][0]):
+                if self.size <= self.max_size:
+                    break
+                self._remove(path)
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        entry = self._entries.pop(path, None)
+        if entry:
+            self.size -= entry[1]
+
+    def clear(self):
+        """Remove all entries from the cache.
+
+        """
+        for path in list(self._entries):
+            self._remove(path)
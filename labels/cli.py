@@ -0,0 +1,168 @@
+# This file is part of pylabels, a Python library to create PDFs for printing
+# labels.
+# Copyright (C) 2012, 2013, 2014, 2015 Blair Bonnett
+#
+# pylabels is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# pylabels is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pylabels.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Command line tool to create labels from a file of records.
+
+The records are read from a CSV file (one record per row, as a dictionary
+keyed by the column headings) or a JSON lines file (one JSON value per line)
+and streamed through a drawing function loaded from a plugin. For example::
+
+    pylabels --spec specs.json --plugin mylabels:draw_label records.csv -o labels.pdf
+
+The specification is either a JSON object of labels.Specification parameters
+(given directly or as a filename), or a module:name reference to an existing
+labels.Specification instance.
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import sys
+
+from .loading import load_object, load_specification, read_records, record_format, open_records, add_records
+from .sheet import Sheet
+from .used import UsedLabels
+
+
+def parse_pages(value):
+    """Parse a page range such as '2-5' or a single page such as '7' into a
+    tuple of the first and last page numbers.
+
+    """
+    first, _, last = value.partition('-')
+    try:
+        first, last = int(first), int(last or first)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid page range: {0!r}".format(value))
+    if first < 1 or last < first:
+        raise argparse.ArgumentTypeError("invalid page range: {0!r}".format(value))
+    return first, last
+
+
+def create_parser():
+    """Create the parser for the command line arguments.
+
+    """
+    parser = argparse.ArgumentParser(prog='pylabels', description="Create a PDF of labels from a file of records.")
+    parser.add_argument('input',
+                        help="The CSV or JSON lines file of records, or - for standard input.")
+    parser.add_argument('-o', '--output', required=True,
+                        help="The PDF to create. When saving shards, this is formatted with the shard number, "
+                             "e.g., labels-{0:03d}.pdf.")
+    parser.add_argument('--spec', required=True,
+                        help="The sheet specification: a JSON object of labels.Specification parameters, "
+                             "a JSON file, or a module:name reference to a Specification instance.")
+    parser.add_argument('--plugin', required=True,
+                        help="The drawing function as module:name or file.py:name. The name defaults to "
+                             "draw_label. It is given each record as the object to draw.")
+    parser.add_argument('--format', choices=('csv', 'jsonl'),
+                        help="The format of the input. By default this is guessed from the file extension.")
+    parser.add_argument('--count-field',
+                        help="Field of each record giving the number of copies of its label.")
+    parser.add_argument('--collapse', action='store_true',
+                        help="Merge runs of identical consecutive records into one label.")
+    parser.add_argument('--pages', type=parse_pages,
+                        help="Only draw and save the given range of pages, e.g., 2-5. The labels are placed in the "
+                             "same way as for the whole run.")
+    parser.add_argument('--used',
+                        help="File of labels already used on partial pages, either JSON mapping page numbers to "
+                             "lists of [row, column] pairs or CSV rows of page,row,column.")
+    parser.add_argument('--fill-order', default='rows', choices=('rows', 'columns', 'serpentine', 'serpentine_columns'),
+                        help="The order to fill the labels on each page in.")
+    parser.add_argument('--border', action='store_true',
+                        help="Draw a border around each label.")
+    parser.add_argument('--shade-missing', action='store_true',
+                        help="Shade the labels already used on partial pages.")
+    parser.add_argument('--pages-per-shard', type=int,
+                        help="Save the output as several PDFs with this many pages each.")
+    parser.add_argument('--manifest',
+                        help="When saving shards, save a JSON manifest of the shards to this file.")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Number of shards to save at once. Requires --pages-per-shard.")
+    parser.add_argument('--checkpoint',
+                        help="Directory to save checkpoints to and resume from.")
+    parser.add_argument('--quiet', action='store_true',
+                        help="Do not print progress or a summary.")
+    return parser
+
+
+def main(argv=None):
+    """Run the command line tool.
+
+    Parameters
+    ----------
+    argv: list of strings, default None
+        The command line arguments. If None, sys.argv is used.
+
+    Returns
+    -------
+    The exit status.
+
+    """
+    parser = create_parser()
+    args = parser.parse_args(argv)
+    if args.workers != 1 and not args.pages_per_shard:
+        parser.error("--workers requires --pages-per-shard")
+    if args.pages and args.pages_per_shard:
+        parser.error("--pages cannot be used with --pages-per-shard")
+
+    # Set up the sheet. Only the selected pages need to be drawn.
+    pages_to_draw = None
+    if args.pages:
+        pages_to_draw = list(range(args.pages[0], args.pages[1] + 1))
+    specs = load_specification(args.spec)
+    drawing_callable = load_object(args.plugin, 'draw_label')
+    progress = None
+    if not args.quiet:
+        progress = lambda event, count, total: print("{0}: {1}{2}".format(
+            event, count, '/{0}'.format(total) if total else ''), file=sys.stderr)
+    sheet = Sheet(specs, drawing_callable, pages_to_draw=pages_to_draw, border=args.border,
+                  shade_missing=args.shade_missing, progress=progress, checkpoint=args.checkpoint,
+                  fill_order=args.fill_order)
+    if args.used:
+        used = UsedLabels(specs.rows, specs.columns)
+        used.load(args.used)
+        sheet.partial_pages(used)
+    if args.checkpoint:
+        sheet.resume()
+
+    # Stream the records onto the sheet.
+    format = args.format or record_format(args.input)
+    f = sys.stdin if args.input == '-' else open_records(args.input, format)
+    try:
+        add_records(sheet, read_records(f, format), count=args.count_field or 1, collapse=args.collapse)
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+    # Save the output.
+    first, last = 1, sheet.page_count
+    if args.pages_per_shard:
+        sheet.save_shards(args.output, args.pages_per_shard, manifest=args.manifest, workers=args.workers)
+    elif args.pages:
+        first, last = args.pages[0], min(args.pages[1], sheet.page_count)
+        if first > last:
+            print("There are only {0:d} page(s).".format(sheet.page_count), file=sys.stderr)
+            return 1
+        sheet.save(args.output, pages=(first, last))
+    else:
+        sheet.save(args.output)
+    if not args.quiet:
+        labels = sheet.label_range(first, last) if last else None
+        print("{0:d} label(s) output on {1:d} page(s).".format(labels[1] - labels[0] + 1 if labels else 0,
+                                                               last - first + 1), file=sys.stderr)
+    return 0
@@ -0,0 +1,61 @@
+# This file is part of pylabels, a Python library to create PDFs for printing
+# labels.
+# Copyright (C) 2012, 2013, 2014, 2015 Blair Bonnett
+#
+# pylabels is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# pylabels is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pylabels.  If not, see <http://www.gnu.org/licenses/>.
+
+import random
+
+
+class LabelContext(object):
+    """Information about where a label is placed, given to drawing functions
+    of sheets created with the context parameter set.
+
+    Everything here depends only on the position of the label in the sequence
+    of labels added to the sheet, so a label is drawn the same way whether the
+    whole sheet is created or only some of its pages (with pages_to_draw, a
+    labels.Job slice or a resumed checkpoint), in any order and in any
+    process.
+
+    Attributes
+    ----------
+    index: positive integer
+        The number of the label, counting from 1 in the order the labels were
+        added with each copy counted separately. When several copies of a
+        label are added, they share one drawing and this is the number of the
+        first copy.
+    page, row, column: positive integers
+        Where the label (or its first copy) is placed. These are None for
+        labels which are not placed on the sheet, e.g., by export_labels.
+    random: random.Random instance
+        A random number generator seeded from the sheet's seed and the index.
+
+    """
+    def __init__(self, index, page=None, row=None, column=None, seed=0):
+        self.index = index
+        self.page = page
+        self.row = row
+        self.column = column
+        self.seed = seed
+        self._random = None
+
+    @property
+    def random(self):
+        # Only create the generator if it is used.
+        if self._random is None:
+            self._random = random.Random(self.seed * 0x100000000 + self.index)
+        return self._random
+
+    def __repr__(self):
+        return "LabelContext(index={0!r}, page={1!r}, row={2!r}, column={3!r})".format(
+            self.index, self.page, self.row, self.column)
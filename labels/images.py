@@ -0,0 +1,238 @@
+# This file is part of pylabels, a Python library to create PDFs for printing
+# labels.
+# Copyright (C) 2012, 2013, 2014, 2015 Blair Bonnett
+#
+# pylabels is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# pylabels is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pylabels.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import mmap
+import os
+import threading
+
+
+class ImageRegistry(object):
+    """Registry of images used by the labels on a sheet.
+
+    Building a new ReportLab Image from a filename for every label means the
+    file is read and decoded each time the label is rendered, and each copy is
+    embedded in the PDF separately. Images obtained through a registry are
+    decoded once, and when the sheet is saved each distinct image is embedded
+    in the PDF once and referenced from every label which uses it.
+
+    Each sheet has a registry as its images attribute, which the drawing
+    function can use to add images to the labels::
+
+        def draw_label(label, width, height, obj):
+            label.add(sheet.images.image('logo.png', 0, 0, 40, 20))
+
+    Notes
+    -----
+    Images are recognised by the decoded image object held in the registry.
+    Labels which have been pickled (e.g., by a checkpoint or label cache) hold
+    their own copy of the image, which is embedded separately as for any other
+    image.
+
+    """
+    def __init__(self, mmap_threshold=1024*1024):
+        """
+        Parameters
+        ----------
+        mmap_threshold: non-negative integer, default 1MiB
+            Image files at least this many bytes long are memory mapped while
+            they are decoded rather than being read into memory.
+
+        """
+        self.mmap_threshold = mmap_threshold
+        self._images = {}
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._images)
+
+    def _key(self, source):
+        """Get the key identifying an image source. Not intended for external
+        use.
+
+        """
+        if isinstance(source, (bytes, bytearray)):
+            return 'data:' + hashlib.sha1(source).hexdigest()
+        if hasattr(source, 'getim') or hasattr(source, 'read'):
+            return 'object:{0:d}:{1:d}'.format(id(self), id(source))
+        return 'file:' + os.path.abspath(source)
+
+    def _decode(self, source):
+        """Load and decode an image. Not intended for external use.
+
+        """
+        from PIL import Image as PILImage
+        from io import BytesIO
+
+        # Already decoded.
+        if hasattr(source, 'getim'):
+            image = source
+
+        # Image data or a file-like object.
+        elif isinstance(source, (bytes, bytearray)):
+            image = PILImage.open(BytesIO(source))
+            image.load()
+        elif hasattr(source, 'read'):
+            image = PILImage.open(source)
+            image.load()
+
+        # A filename. Large files are mapped rather than read.
+        else:
+            with open(source, 'rb') as f:
+                if os.fstat(f.fileno()).st_size >= self.mmap_threshold:
+                    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    try:
+                        image = PILImage.open(data)
+                        image.load()
+                    finally:
+                        data.close()
+                else:
+                    image = PILImage.open(f)
+                    image.load()
+
+        # The renderers only use these modes, so convert anything else now
+        # rather than every time the image is drawn.
+        if image.mode not in ('RGB', 'L', 'CMYK'):
+            image = image.convert('RGB')
+        return image
+
+    def get(self, source):
+        """Get the decoded image for a source, decoding it if this is the first
+        time it has been used.
+
+        Parameters
+        ----------
+        source: path, bytes, file-like object or PIL image
+            The image. Filenames are identified by their absolute path, data
+            by its contents, and other objects by their identity. The registry
+            keeps a reference to such objects until it is cleared.
+
+        Returns
+        -------
+        The decoded PIL image. This must not be modified.
+
+        """
+        key = self._key(source)
+        image = self._images.get(key)
+        if image is None:
+            with self._lock:
+                image = self._images.get(key)
+                if image is None:
+                    image = self._decode(source)
+                    self._images[key] = image
+
+                    # Name the form after the source so that registries
+                    # sharing a document use the same form for the same file.
+                    name = 'pylabels_image' + hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+                    # Objects are identified by their id, so keep hold of
+                    # them; otherwise a new object could reuse the id of one
+                    # which has been garbage collected and get its image.
+                    kept = source if key.startswith('object:') else None
+                    self._entries[id(image)] = (image, name, kept)
+        return image
+
+    def image(self, source, x=0, y=0, width=None, height=None):
+        """Create a ReportLab Image shape using a registered image.
+
+        Parameters
+        ----------
+        source: path, bytes, file-like object or PIL image
+            The image, as for the get() method.
+        x, y: reals, default 0
+            The position of the bottom left corner of the image in points.
+        width, height: positive reals, default None
+            The size of the image in points. If None, the size of the image in
+            pixels is used.
+
+        Returns
+        -------
+        A reportlab.graphics.shapes.Image instance.
+
+        """
+        from reportlab.graphics.shapes import Image
+        image = self.get(source)
+        if width is None:
+            width = image.size[0]
+        if height is None:
+            height = image.size[1]
+        return Image(x, y, width, height, image)
+
+    def form_name(self, image):
+        """Get the name of the PDF form used for a registered image, or None if
+        the image is not registered.
+
+        """
+        entry = self._entries.get(id(image))
+        if entry is None or entry[0] is not image:
+            return None
+        return entry[1]
+
+    def define_forms(self, canvas, names):
+        """Add the forms for the given registered images to a canvas. Not
+        intended for external use.
+
+        """
+        from reportlab.lib.utils import ImageReader
+        for image, name, kept in self._entries.values():
+            if name in names and not canvas.hasForm(name):
+                canvas.beginForm(name, 0, 0, 1, 1)
+                canvas.drawImage(ImageReader(image), 0, 0, 1, 1)
+                canvas.endForm()
+
+    def clear(self):
+        """Forget all the registered images. Labels already created with them
+        are not affected.
+
+        """
+        with self._lock:
+            self._images.clear()
+            self._entries.clear()
+
+
+def pdf_renderer(registry):
+    """Create a ReportLab PDF renderer which draws the images from a registry
+    through forms. Not intended for external use.
+
+    The renderer has a used attribute with the set of forms referenced; these
+    must be defined with the registry's define_forms() method before the
+    canvas is saved.
+
+    """
+    from reportlab.graphics.renderPDF import _PDFRenderer
+
+    class RegistryPDFRenderer(_PDFRenderer):
+        def __init__(self):
+            _PDFRenderer.__init__(self)
+            self.used = set()
+
+        def drawImage(self, image):
+            name = registry.form_name(image.path)
+            if name is None:
+                return _PDFRenderer.drawImage(self, image)
+
+            # The form draws the image in a unit square, so scale it to the
+            # size of the image. The form is defined when the canvas is saved.
+            canvas = self._canvas
+            canvas.saveState()
+            canvas.translate(image.x, image.y)
+            canvas.scale(image.width, image.height)
+            canvas.doForm(name)
+            canvas.restoreState()
+            self.used.add(name)
+
+    return RegistryPDFRenderer()
@@ -0,0 +1,185 @@
+# This file is part of pylabels, a Python library to create PDFs for printing
+# labels.
+# Copyright (C) 2012, 2013, 2014, 2015 Blair Bonnett
+#
+# pylabels is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# pylabels is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pylabels.  If not, see <http://www.gnu.org/licenses/>.
+
+import heapq
+import json
+import time
+
+# Use the most precise clocks available.
+_wall_clock = getattr(time, 'perf_counter', time.time)
+_cpu_clock = getattr(time, 'process_time', None) or time.clock
+
+
+class Instrumentation(object):
+    """Timing and counters for the different phases of creating labels.
+
+    An instance of this is attached to a sheet created with instrumentation
+    enabled (see the instrument parameter of labels.Sheet), and is updated as
+    labels are added and the sheet is saved or previewed. The phases recorded
+    are:
+
+    drawing
+        Calls to the user's drawing function.
+    placement
+        Finding the position of and adding the copies of each label.
+    render
+        Rendering each page onto the PDF canvas in save().
+    write
+        Formatting and writing the PDF in save().
+    preview
+        Rendering a page to an image in preview() or preview_string().
+    raster
+        Rendering and packing each page in raster() or save_raster().
+
+    """
+    def __init__(self, slowest=10):
+        """
+        Parameters
+        ----------
+        slowest: non-negative integer, default 10
+            How many of the slowest labels to keep details of.
+
+        """
+        self.slowest = slowest
+        self.reset()
+
+    def reset(self):
+        """Clear all recorded values.
+
+        """
+        self.phases = {}
+        self.bytes_written = 0
+        self._slowest = []
+        self._label_number = 0
+
+    def start(self):
+        """Start timing something.
+
+        Returns
+        -------
+        An opaque token to pass to the stop() or label() methods.
+
+        """
+        return (_wall_clock(), _cpu_clock())
+
+    def stop(self, phase, started, call=True):
+        """Record the time taken by a phase.
+
+        Parameters
+        ----------
+        phase: string
+            The name of the phase.
+        started: token
+            The token returned by start() when the phase began.
+        call: Boolean, default True
+            Whether to count this as a call of the phase. Use False to add the
+            time of a phase which is interrupted by another one and then
+            continued.
+
+        Returns
+        -------
+        A new token for the current time, allowing the next phase to be timed
+        without another call to start().
+
+        """
+        now = self.start()
+        record = self.phases.get(phase)
+        if record is None:
+            record = self.phases[phase] = {'calls': 0, 'wall': 0.0, 'cpu': 0.0}
+        if call:
+            record['calls'] += 1
+        record['wall'] += now[0] - started[0]
+        record['cpu'] += now[1] - started[1]
+        return now
+
+    def label(self, obj, started):
+        """Record the total time taken to add a label.
+
+        Parameters
+        ----------
+        obj:
+            The object drawn on the label. Its repr() is only computed if it is
+            one of the slowest labels so far.
+        started: token
+            The token returned by start() when the label was started.
+
+        """
+        elapsed = _wall_clock() - started[0]
+        self._label_number += 1
+        if not self.slowest:
+            return
+
+        # Keep the slowest labels in a min-heap so the quickest of them can be
+        # replaced cheaply. The label number breaks any ties.
+        if len(self._slowest) < self.slowest:
+            heapq.heappush(self._slowest, (elapsed, self._label_number, repr(obj)))
+        elif elapsed > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, (elapsed, self._label_number, repr(obj)))
+
+    def add_bytes(self, count):
+        """Record that some bytes were written.
+
+        """
+        self.bytes_written += count
+
+    def slowest_labels(self):
+        """Get the slowest labels recorded, slowest first.
+
+        Returns
+        -------
+        A list of dictionaries with 'label' (the order in which the label was
+        added, starting at 1), 'object' (the repr of the object) and 'seconds'
+        entries.
+
+        """
+        return [{'label': number, 'object': obj, 'seconds': elapsed}
+                for elapsed, number, obj in sorted(self._slowest, reverse=True)]
+
+    def as_dict(self):
+        """Get all the recorded values as a dictionary.
+
+        """
+        return {
+            'phases': dict((name, dict(record)) for name, record in self.phases.items()),
+            'labels': self._label_number,
+            'slowest_labels': self.slowest_labels(),
+            'bytes_written': self.bytes_written,
+        }
+
+    def as_json(self, **kwargs):
+        """Get all the recorded values as a JSON encoded string. Any keyword
+        arguments are passed to json.dumps().
+
+        """
+        return json.dumps(self.as_dict(), **kwargs)
+
+
+class CountingWriter(object):
+    """Wrapper around a file-like object which counts how many bytes are
+    written to it. Any other attributes are passed through to the wrapped
+    object.
+
+    """
+    def __init__(self, filelike):
+        self._filelike = filelike
+        self.count = 0
+
+    def write(self, data):
+        self.count += len(data)
+        return self._filelike.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._filelike, name)
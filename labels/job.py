@@ -0,0 +1,235 @@
+# This file is part of pylabels, a Python library to create PDFs for printing
+# labels.
+# Copyright (C) 2012, 2013, 2014, 2015 Blair Bonnett
+#
+# pylabels is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# pylabels is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pylabels.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Serializable descriptions of labelling jobs.
+
+A Sheet holds the drawing function and the finished drawings, so it cannot be
+sent to another process or machine. A Job holds only what is needed to create
+the sheet again: the specification, the import path of the drawing function,
+where to read the objects from, the used labels on partial pages and the range
+of pages to output. It can be converted to and from JSON or pickled.
+
+A large job can be split into slices of pages which are run independently,
+e.g., on several machines sharing a filesystem::
+
+    job = Job({'sheet_width': 210, ...}, 'mylabels:draw_label',
+              {'path': 'records.csv'})
+    slices = job.split(100)
+    # On each worker:
+    Job.from_json(description).run('part-{0:03d}.pdf'.format(n))
+
+Every slice places all the labels in the same way as the full job, but only
+calls the drawing function for the labels on its own pages. The output of the
+slices, taken in order, has the same pages as the output of the full job
+(provided the drawing function only depends on the object it is given, and on
+the label context if the context option is used).
+
+"""
+
+import json
+from itertools import islice
+
+from .loading import load_object, load_specification, read_records, record_format, open_records, add_records
+from .sheet import Sheet
+from .specifications import Specification
+
+
+class Job(object):
+    """Description of a labelling job.
+
+    """
+    def __init__(self, specification, drawing, source, count=1, collapse=False, used=None, pages=None,
+                 options=None):
+        """
+        Parameters
+        ----------
+        specification: dictionary or string
+            The labels.Specification parameters, or a module:name reference to
+            a Specification instance.
+        drawing: string
+            The drawing function as module:name or path/to/file.py:name.
+        source: dictionary
+            Where to get the objects from. Either 'records' with a list of the
+            objects, or 'path' with the filename of a CSV or JSON lines file
+            and optionally its 'format' ('csv' or 'jsonl', guessed from the
+            filename if not given). In both cases, 'start' and 'stop' can give
+            the range of records to use, counted from zero.
+        count: positive integer or string, default 1
+            The number of copies of each label, or the name of the field of
+            each record holding its count.
+        collapse: Boolean, default False
+            Whether to merge runs of identical records; see Sheet.add_labels.
+        used: dictionary, default None
+            The used labels on partial pages, mapping page numbers to lists of
+            [row, column] pairs.
+        pages: list of two positive integers, default None
+            The first and last page to output. If None, all pages are output.
+        options: dictionary, default None
+            Other keyword arguments for labels.Sheet which can be stored as
+            JSON, e.g., border, shade_missing or fill_order.
+
+        """
+        self.specification = specification
+        self.drawing = drawing
+        self.source = dict(source)
+        self.count = count
+        self.collapse = collapse
+        self.used = dict((int(page), [list(p) for p in positions]) for page, positions in (used or {}).items())
+        self.pages = list(pages) if pages else None
+        self.options = dict(options or {})
+
+    def as_dict(self):
+        """Get the description as a dictionary which can be stored as JSON. """
+        return {
+            'specification': self.specification,
+            'drawing': self.drawing,
+            'source': self.source,
+            'count': self.count,
+            'collapse': self.collapse,
+            'used': dict((str(page), positions) for page, positions in self.used.items()),
+            'pages': self.pages,
+            'options': self.options,
+        }
+
+    def as_json(self):
+        """Get the description as a JSON string. """
+        return json.dumps(self.as_dict(), sort_keys=True)
+
+    @classmethod
+    def from_dict(cls, description):
+        """Create a job from a dictionary created by as_dict(). """
+        return cls(**description)
+
+    @classmethod
+    def from_json(cls, description):
+        """Create a job from a JSON string created by as_json(). """
+        return cls.from_dict(json.loads(description))
+
+    def copy(self, **changes):
+        """Create a copy of the job with some of its values changed. """
+        description = self.as_dict()
+        description.update(changes)
+        return self.from_dict(description)
+
+    def _records(self):
+        """Generator giving the records to use. Not intended for external use.
+
+        """
+        source = self.source
+        start, stop = source.get('start', 0), source.get('stop')
+        if 'records' in source:
+            for record in islice(source['records'], start, stop):
+                yield record
+            return
+
+        # Read them from the file.
+        path = source['path']
+        format = source.get('format') or record_format(path)
+        with open_records(path, format) as f:
+            for record in islice(read_records(f, format), start, stop):
+                yield record
+
+    def build(self, pages_to_draw=None, draw=True):
+        """Create the sheet for the job and add the labels to it.
+
+        Parameters
+        ----------
+        pages_to_draw: list of positive integers, default None
+            The pages to call the drawing function for. If None, this is the
+            page range of the job (or every page if there is no range).
+        draw: Boolean, default True
+            Whether to draw the labels at all. If False, the labels are placed
+            without calling the drawing function, and pages_to_draw is ignored.
+
+        Returns
+        -------
+        The labels.Sheet instance.
+
+        """
+        # Create the sheet.
+        if isinstance(self.specification, dict):
+            specification = Specification(**self.specification)
+        else:
+            specification = load_specification(self.specification)
+        drawing_callable = load_object(self.drawing, 'draw_label')
+        if not draw:
+            pages_to_draw = []
+        elif pages_to_draw is None and self.pages:
+            pages_to_draw = range(self.pages[0], self.pages[1] + 1)
+        sheet = Sheet(specification, drawing_callable, pages_to_draw=pages_to_draw, **self.options)
+        for page in sorted(self.used):
+            sheet.partial_page(page, [tuple(position) for position in self.used[page]])
+
+        # And add the labels.
+        add_records(sheet, self._records(), count=self.count, collapse=self.collapse)
+        return sheet
+
+    def plan(self):
+        """Count the pages and labels in the whole job without drawing any of
+        the labels.
+
+        Returns
+        -------
+        A tuple of the number of pages and labels.
+
+        """
+        sheet = self.build(draw=False)
+        return sheet.page_count, sheet.label_count
+
+    def split(self, pages_per_slice):
+        """Split the job into slices with a fixed number of pages.
+
+        Parameters
+        ----------
+        pages_per_slice: positive integer
+            The maximum number of pages in each slice. All slices except the
+            last will have exactly this many pages.
+
+        Returns
+        -------
+        A list of Job instances, one for each slice, in order.
+
+        """
+        pages_per_slice = int(pages_per_slice)
+        if pages_per_slice < 1:
+            raise ValueError("There must be at least one page per slice.")
+        first, last = self.pages or (1, self.plan()[0])
+        return [self.copy(pages=[start, min(start + pages_per_slice - 1, last)])
+                for start in range(first, last + 1, pages_per_slice)]
+
+    def run(self, filelike):
+        """Create the labels and save the pages of the job as a PDF.
+
+        Parameters
+        ----------
+        filelike: path or file-like object
+            The filename or file-like object to save the PDF under.
+
+        Returns
+        -------
+        A dictionary with the 'first_page' and 'last_page' saved, and the
+        'first_label' and 'last_label' on them (numbered from 1 in the order
+        they were added to the full job, or None if there are no labels).
+
+        """
+        sheet = self.build()
+        first, last = self.pages or (1, sheet.page_count)
+        last = min(last, sheet.page_count)
+        if first > last:
+            raise ValueError("The job has no pages in the range {0:d} to {1:d}.".format(*self.pages))
+        sheet.save(filelike, pages=(first, last))
+        first_label, last_label = sheet.label_range(first, last) or (None, None)
+        return {'first_page': first, 'last_page': last, 'first_label': first_label, 'last_label': last_label}
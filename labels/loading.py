@@ -0,0 +1,130 @@
+# This file is part of pylabels, a Python library to create PDFs for printing
+# labels.
+# Copyright (C) 2012, 2013, 2014, 2015 Blair Bonnett
+#
+# pylabels is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# pylabels is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pylabels.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Loading of specifications, drawing functions and records by reference.
+
+These are shared by the command line tool, the render service and
+labels.Job, which all describe what to create with strings and files rather
+than Python objects.
+
+"""
+
+import importlib
+import io
+import json
+import os.path
+import sys
+
+
+def load_object(reference, default=None):
+    """Load an object from a 'module:name' or 'path/to/file.py:name'
+    reference. If the name is not given, the default is used.
+
+    """
+    module, _, name = reference.partition(':')
+    name = name or default
+    if not name:
+        raise ValueError("No object name given in {0}.".format(reference))
+    if module.endswith('.py'):
+        import runpy
+        namespace = runpy.run_path(module)
+        try:
+            return namespace[name]
+        except KeyError:
+            raise AttributeError("{0} has no attribute {1}.".format(module, name))
+    return getattr(importlib.import_module(module), name)
+
+
+def load_specification(value):
+    """Load a specification from a JSON string, a JSON file, or a module:name
+    reference.
+
+    """
+    from .specifications import Specification
+    if value.lstrip().startswith('{'):
+        fields = json.loads(value)
+    elif os.path.exists(value):
+        with open(value) as f:
+            fields = json.load(f)
+    else:
+        spec = load_object(value)
+        if not isinstance(spec, Specification):
+            raise TypeError("{0} is not a labels.Specification.".format(value))
+        return spec
+    return Specification(**fields)
+
+
+def read_records(f, format):
+    """Generator which reads the records from an open file one at a time.
+
+    """
+    if format == 'csv':
+        import csv
+        for record in csv.DictReader(f):
+            yield record
+    else:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def record_format(path):
+    """Guess the format of a file of records ('csv' or 'jsonl') from its
+    filename.
+
+    """
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+
+def open_records(path, format):
+    """Open a file of records in the way its format needs.
+
+    """
+    if format == 'csv' and sys.version_info[0] < 3:
+        return open(path, 'rb')
+    return io.open(path, newline='' if format == 'csv' else None, encoding='utf-8')
+
+
+def add_records(sheet, records, count=1, collapse=False):
+    """Add a stream of records to a sheet.
+
+    Parameters
+    ----------
+    sheet: labels.Sheet instance
+        The sheet to add the labels to.
+    records: iterable
+        The records to add.
+    count: positive integer or string, default 1
+        The number of copies of each label, or the name of the field of each
+        record holding its count.
+    collapse: Boolean, default False
+        Whether to merge runs of identical records; see Sheet.add_labels.
+
+    """
+    if isinstance(count, int):
+        sheet.add_labels(records, count=count, collapse=collapse)
+        return
+
+    # add_labels takes the next count after each object, so the count can be
+    # read from the record which was just taken.
+    current = [None]
+
+    def counted():
+        for record in records:
+            current[0] = int(record[count])
+            yield record
+
+    sheet.add_labels(counted(), count=iter(lambda: current[0], None), collapse=collapse)
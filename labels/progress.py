@@ -0,0 +1,119 @@
+# This file is part of pylabels, a Python library to create PDFs for printing
+# labels.
+# Copyright (C) 2012, 2013, 2014, 2015 Blair Bonnett
+#
+# pylabels is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# pylabels is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pylabels.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+
+# Use the most precise clock available.
+_clock = getattr(time, 'monotonic', time.time)
+
+
+class Cancelled(Exception):
+    """Raised when an operation is stopped through a CancellationToken. """
+    pass
+
+
+class CancellationToken(object):
+    """Token used to cooperatively cancel adding labels to or saving a sheet.
+
+    Give the token to a sheet through the cancel parameter of labels.Sheet,
+    and call its cancel() method (e.g., from another thread) to stop the sheet
+    at the next label or page. The operation in progress then raises a
+    Cancelled exception.
+
+    """
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        """Request that any operations using this token stop.
+
+        """
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        """Whether cancellation has been requested. """
+        return self._event.is_set()
+
+    def check(self):
+        """Raise a Cancelled exception if cancellation has been requested.
+
+        """
+        if self._event.is_set():
+            raise Cancelled("Operation cancelled.")
+
+
+class ProgressReporter(object):
+    """Rate-limited wrapper around a progress callback.
+
+    The callback is given three parameters: the name of the event, the
+    current count, and the total count (or None if the total is not known).
+    The events are:
+
+    labels
+        The number of labels placed on the sheet so far.
+    pages
+        The number of pages which have been completely filled.
+    rendered
+        The number of pages rendered by save(), with the total being the
+        number of pages in the sheet.
+    written
+        The number of bytes written by save(). When streaming, this is also
+        reported after each page, with the total not yet known.
+    exported
+        The number of distinct label images saved by export_labels().
+
+    """
+    def __init__(self, callback, interval=0.5):
+        """
+        Parameters
+        ----------
+        callback: callable
+            The function to give the progress to.
+        interval: non-negative real, default 0.5
+            The minimum number of seconds between calls for each event. The
+            final values at the end of add_labels() and save() are always
+            reported.
+
+        """
+        self.callback = callback
+        self.interval = interval
+        self._last = {}
+
+    def report(self, event, count, total=None, force=False):
+        """Report the progress of an event if enough time has passed since it
+        was last reported.
+
+        Parameters
+        ----------
+        event: string
+            The name of the event.
+        count: non-negative integer
+            The current count.
+        total: non-negative integer, default None
+            The total count if known.
+        force: Boolean, default False
+            Report the progress regardless of when it was last reported.
+
+        """
+        now = _clock()
+        if not force and self.interval:
+            last = self._last.get(event)
+            if last is not None and (now - last) < self.interval:
+                return
+        self._last[event] = now
+        self.callback(event, count, total)
@@ -0,0 +1,425 @@
+# This file is part of pylabels, a Python library to create PDFs for printing
+# labels.
+# Copyright (C) 2012, 2013, 2014, 2015 Blair Bonnett
+#
+# pylabels is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# pylabels is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pylabels.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Local render service which keeps a pool of warm worker processes.
+
+Starting a new Python process for every job means importing ReportLab,
+registering fonts and loading the drawing functions each time, which can take
+longer than creating the labels for a small job. The service does this once per
+worker process and then accepts jobs over HTTP, either on a localhost port or a
+Unix socket. For example::
+
+    pylabels-server --config server.json --port 8765 --workers 4
+
+The configuration is a JSON object with optional 'fonts' (mapping font names to
+TrueType files to register), 'specs' (mapping names to Specification
+parameters, or to module:name references) and 'plugins' (mapping names to
+drawing functions as module:name or file.py:name) entries.
+
+Jobs are POSTed to /render as a JSON object with the entries:
+
+spec
+    The name of a configured specification, or an object of Specification
+    parameters.
+plugin
+    The name of a configured drawing function.
+records
+    The list of objects to draw.
+count
+    Optional number of copies of each label, or a list of counts.
+border, shade_missing, pages, partial_pages
+    Optional Sheet settings; partial_pages maps page numbers to lists of [row,
+    column] pairs.
+format
+    'pdf' (the default) for the whole sheet, or an image format such as 'png'
+    to preview a single page.
+page, dpi
+    The page to preview and its resolution, defaulting to 1 and 72.
+
+The response is the PDF or image. It is sent once the job has finished: the
+output is created in a worker process and handed back through the pool as a
+single value. Jobs for the service are expected to be small; for large sheets,
+use Sheet.iter_pdf() or the streaming option of Sheet.save() directly.
+
+Invalid jobs get a 400 response, and errors while drawing or rendering the
+labels (e.g., an exception raised by a drawing function) a 500 response. If a
+timeout is set and a job takes longer, the response is a 504. In all these
+cases the body is a JSON object with an 'error' entry. A job which times out
+keeps its worker busy until it finishes, as the pool cannot stop a single job.
+
+GET /status returns the number of workers, the number of jobs running and
+waiting to run, and the number completed as JSON.
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import io
+import json
+import importlib
+import os
+import sys
+import threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn, UnixStreamServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn, UnixStreamServer
+
+from .loading import load_object, load_specification
+from .sheet import Sheet
+from .specifications import Specification
+
+
+class JobError(ValueError):
+    """Raised when a job description is invalid. """
+    pass
+
+
+class RenderError(Exception):
+    """Raised when a valid job fails while it is being run. """
+    pass
+
+
+class JobTimeout(RenderError):
+    """Raised when a job does not finish within the timeout. """
+    pass
+
+
+# The specifications and drawing functions loaded in this worker process.
+_specs = {}
+_plugins = {}
+
+
+def load_config(config):
+    """Register the fonts and load the specifications and drawing functions
+    from a configuration dictionary into this process.
+
+    """
+    fonts = config.get('fonts', {})
+    if fonts:
+        from reportlab.pdfbase.ttfonts import TTFont
+        from reportlab.pdfbase.pdfmetrics import registerFont
+        for name, filename in fonts.items():
+            registerFont(TTFont(name, filename))
+    for name, spec in config.get('specs', {}).items():
+        if isinstance(spec, dict):
+            _specs[name] = Specification(**spec)
+        else:
+            _specs[name] = load_specification(spec)
+    for name, reference in config.get('plugins', {}).items():
+        _plugins[name] = load_object(reference, 'draw_label')
+
+    # Import the rendering modules now rather than during the first job.
+    for module in ('reportlab.graphics.shapes', 'reportlab.graphics.renderPDF', 'reportlab.graphics.renderPM',
+                   'reportlab.pdfgen.canvas'):
+        importlib.import_module(module)
+
+
+def run_job(job):
+    """Run a job in this process.
+
+    Returns
+    -------
+    A tuple of the MIME type and the contents of the output.
+
+    Raises
+    ------
+    JobError:
+        If the job is invalid. Any other exception comes from creating the
+        labels.
+
+    """
+    if not isinstance(job, dict):
+        raise JobError("The job must be a JSON object.")
+
+    # Find the specification and drawing function.
+    spec = job.get('spec')
+    if isinstance(spec, dict):
+        try:
+            spec = Specification(**spec)
+        except (TypeError, ValueError) as e:
+            raise JobError("Invalid specification: {0}".format(e))
+    elif spec in _specs:
+        spec = _specs[spec]
+    else:
+        raise JobError("Unknown specification {0!r}.".format(spec))
+    plugin = job.get('plugin')
+    if plugin not in _plugins:
+        raise JobError("Unknown plugin {0!r}.".format(plugin))
+
+    # Create the sheet.
+    try:
+        sheet = Sheet(spec, _plugins[plugin], pages_to_draw=job.get('pages'), border=job.get('border', False),
+                      shade_missing=job.get('shade_missing', False))
+        for page, positions in sorted(job.get('partial_pages', {}).items(), key=lambda item: int(item[0])):
+            sheet.partial_page(int(page), [tuple(position) for position in positions])
+        format = job.get('format', 'pdf').lower()
+        page = int(job.get('page', 1))
+        dpi = float(job.get('dpi', 72))
+    except (AttributeError, TypeError, ValueError) as e:
+        raise JobError("Invalid job: {0}".format(e))
+    records, count = job.get('records', []), job.get('count', 1)
+    if not isinstance(records, list):
+        raise JobError("The records must be a list.")
+    if not isinstance(count, (int, list)):
+        raise JobError("The count must be an integer or a list.")
+
+    # Add the labels; errors from here on are not the fault of the job.
+    sheet.add_labels(records, count=count)
+
+    # And output it.
+    if format == 'pdf':
+        output = io.BytesIO()
+        sheet.save(output)
+        return 'application/pdf', output.getvalue()
+    if page < 1 or page > sheet.page_count:
+        raise JobError("Invalid page number; should be between 1 and {0:d}.".format(sheet.page_count))
+    image = sheet.preview_string(page, format=format, dpi=dpi)
+    return 'image/{0}'.format('jpeg' if format == 'jpg' else format), image
+
+
+def _run_job(job):
+    """Run a job in a worker process, returning any error as a string so it
+    can be passed back to the server. Not intended for external use.
+
+    """
+    try:
+        return 'ok', run_job(job)
+    except JobError as e:
+        return 'invalid', str(e)
+    except Exception as e:
+        return 'failed', '{0}: {1}'.format(type(e).__name__, e)
+
+
+class RenderService(object):
+    """Pool of warm worker processes with a bounded queue of jobs.
+
+    """
+    def __init__(self, config, workers=2, max_queue=100, timeout=None):
+        """
+        Parameters
+        ----------
+        config: dictionary
+            The fonts, specifications and drawing functions to load into each
+            worker (see the module documentation).
+        workers: positive integer, default 2
+            The number of worker processes, i.e., how many jobs can run at
+            once.
+        max_queue: positive integer, default 100
+            The maximum number of jobs which can be running or waiting.
+        timeout: positive real, default None
+            The number of seconds to wait for each job, including any time
+            spent waiting for a worker. If None, wait until the job finishes.
+
+        """
+        import multiprocessing
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_queue)
+        self._lock = threading.Lock()
+        self.active = 0
+        self.completed = 0
+        self._pool = multiprocessing.Pool(workers, load_config, (config,))
+
+    def submit(self, job, timeout=None):
+        """Run a job on one of the workers, waiting for it to finish.
+
+        Parameters
+        ----------
+        job: dictionary
+            The job (see the module documentation).
+        timeout: positive real, default None
+            The number of seconds to wait for the job. If None, the timeout of
+            the service is used.
+
+        Returns
+        -------
+        A tuple of the MIME type and the output, or None if the queue is full.
+
+        Raises
+        ------
+        JobError:
+            If the job is invalid.
+        JobTimeout:
+            If the job did not finish in time. Its slot in the queue is freed,
+            but the worker stays busy until the job finishes.
+        RenderError:
+            If the job failed while it was being run.
+
+        """
+        import multiprocessing
+        if not isinstance(job, dict):
+            raise JobError("The job must be a JSON object.")
+        if timeout is None:
+            timeout = self.timeout
+        if not self._slots.acquire(False):
+            return None
+        try:
+            with self._lock:
+                self.active += 1
+            try:
+                status, result = self._pool.apply_async(_run_job, (job,)).get(timeout)
+            except multiprocessing.TimeoutError:
+                raise JobTimeout("The job did not finish within {0:g} seconds.".format(timeout))
+        finally:
+            with self._lock:
+                self.active -= 1
+                self.completed += 1
+            self._slots.release()
+        if status == 'invalid':
+            raise JobError(result)
+        if status != 'ok':
+            raise RenderError(result)
+        return result
+
+    def status(self):
+        """Get the state of the service as a dictionary.
+
+        The pool runs the jobs in the order they are submitted, one per worker,
+        so the jobs beyond the number of workers are the ones waiting to run.
+
+        """
+        with self._lock:
+            running = min(self.active, self.workers)
+            return {'workers': self.workers, 'max_queue': self.max_queue, 'running': running,
+                    'queued': self.active - running, 'completed': self.completed}
+
+    def close(self):
+        """Stop the worker processes. """
+        self._pool.close()
+        self._pool.join()
+
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    """Handler for requests to the render service. """
+
+    def address_string(self):
+        # Unix sockets have no client address.
+        return str(self.client_address[0]) if self.client_address else 'local'
+
+    def send_body(self, code, content_type, body):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, code, value):
+        self.send_body(code, 'application/json', json.dumps(value).encode('utf-8'))
+
+    def do_GET(self):
+        if self.path == '/status':
+            self.send_json(200, self.server.service.status())
+        else:
+            self.send_json(404, {'error': 'Not found.'})
+
+    def do_POST(self):
+        if self.path != '/render':
+            self.send_json(404, {'error': 'Not found.'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            job = json.loads(self.rfile.read(length).decode('utf-8'))
+            result = self.server.service.submit(job)
+        except (ValueError, JobError) as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        except JobTimeout as e:
+            self.log_error("Job timed out: %s", e)
+            self.send_json(504, {'error': str(e)})
+            return
+        except Exception as e:
+            self.log_error("Job failed: %s", e)
+            self.send_json(500, {'error': str(e)})
+            return
+        if result is None:
+            self.send_json(503, {'error': 'Too many jobs queued.'})
+            return
+        self.send_body(200, *result)
+
+
+class RenderHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class RenderUnixServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+def create_parser():
+    """Create the parser for the command line arguments.
+
+    """
+    parser = argparse.ArgumentParser(prog='pylabels-server', description="Run a local pylabels render service.")
+    parser.add_argument('--config',
+                        help="JSON file of fonts, specifications and plugins to load into each worker.")
+    parser.add_argument('--host', default='127.0.0.1',
+                        help="Address to listen on. Defaults to localhost only.")
+    parser.add_argument('--port', type=int, default=8765,
+                        help="Port to listen on.")
+    parser.add_argument('--socket',
+                        help="Listen on this Unix socket instead of a TCP port.")
+    parser.add_argument('--workers', type=int, default=2,
+                        help="Number of worker processes.")
+    parser.add_argument('--max-queue', type=int, default=100,
+                        help="Maximum number of jobs running or waiting before new ones are rejected.")
+    parser.add_argument('--timeout', type=float,
+                        help="Seconds to wait for each job before giving up. Defaults to no limit.")
+    return parser
+
+
+def main(argv=None):
+    """Run the render service until interrupted.
+
+    """
+    args = create_parser().parse_args(argv)
+    config = {}
+    if args.config:
+        with open(args.config) as f:
+            config = json.load(f)
+
+    # Start the workers and the server.
+    service = RenderService(config, args.workers, args.max_queue, args.timeout)
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = RenderUnixServer(args.socket, RenderRequestHandler)
+        where = args.socket
+    else:
+        server = RenderHTTPServer((args.host, args.port), RenderRequestHandler)
+        where = 'http://{0}:{1}/'.format(*server.server_address[:2])
+    server.service = service
+    print("pylabels render service listening on {0}".format(where), file=sys.stderr)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
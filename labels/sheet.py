@@ -14,25 +14,231 @@
 # You should have received a copy of the GNU General Public License along with
 # pylabels.  If not, see <http://www.gnu.org/licenses/>.
 
-from reportlab.pdfgen.canvas import Canvas
-from reportlab.graphics import shapes
-from reportlab.lib import colors
+# The ReportLab graphics, PDF and bitmap rendering modules are slow to import,
+# so they are imported when first needed rather than here. This keeps importing
+# pylabels cheap for code which only uses specifications or never previews.
 from reportlab.lib.units import mm
-from reportlab.graphics import renderPDF
-from reportlab.graphics import renderPM
-from reportlab.graphics.shapes import Drawing, ArcPath, Image
 from copy import copy, deepcopy
 from itertools import repeat
+from collections import Counter
+from bisect import bisect_left
+import os
+import json
+
+from .instrumentation import Instrumentation, CountingWriter
+from .progress import ProgressReporter
+from .images import ImageRegistry, pdf_renderer
+from .used import UsedLabels
+from .context import LabelContext
 
 from decimal import Decimal
 mm = Decimal(mm)
 
+def _init_shard_worker(sheet):
+    """Give a worker process the sheet whose shards it will save. Not intended
+    for external use.
+
+    """
+    _save_shard.sheet = sheet
+
+
+def _save_shard(shard):
+    """Save a shard of the sheet in a worker process. Not intended for external
+    use.
+
+    """
+    _save_shard.sheet._save_pages(*shard)
+
+
+def fill_positions(order, rows, columns):
+    """Get the positions of the labels on a page in the order they are filled.
+
+    Parameters
+    ----------
+    order: string, callable or sequence
+        The fill order; see the fill_order parameter of labels.Sheet.
+    rows, columns: positive integers
+        The number of rows and columns of labels on each page.
+
+    Returns
+    -------
+    A list of (row, column) tuples.
+
+    Raises
+    ------
+    ValueError:
+        If the order is not known, or does not contain every position exactly
+        once.
+
+    """
+    if order == 'rows':
+        positions = [(r, c) for r in range(1, rows + 1) for c in range(1, columns + 1)]
+    elif order == 'columns':
+        positions = [(r, c) for c in range(1, columns + 1) for r in range(1, rows + 1)]
+    elif order == 'serpentine':
+        positions = [(r, c if r % 2 else columns + 1 - c) for r in range(1, rows + 1) for c in range(1, columns + 1)]
+    elif order == 'serpentine_columns':
+        positions = [(r if c % 2 else rows + 1 - r, c) for c in range(1, columns + 1) for r in range(1, rows + 1)]
+    elif callable(order):
+        positions = order(rows, columns)
+    elif isinstance(order, str):
+        raise ValueError("Unknown fill order {0:s}.".format(order))
+    else:
+        positions = order
+
+    # Check every position is there once.
+    positions = [(int(r), int(c)) for r, c in positions]
+    expected = [(r, c) for r in range(1, rows + 1) for c in range(1, columns + 1)]
+    if sorted(positions) != expected:
+        raise ValueError("The fill order must contain every (row, column) position exactly once.")
+    return positions
+
+
+def save_merged(sheets, filelike):
+    """Save several sheets as a single PDF.
+
+    The pages of each sheet are added in turn, without calling any of the
+    drawing functions again. Everything is rendered onto the same canvas, so
+    fonts, registered images (from the same file) and identical pages are
+    only stored once in the output.
+
+    Parameters
+    ----------
+    sheets: list of labels.Sheet instances
+        The sheets to save, in order. A sheet restored from a checkpoint
+        directory with its resume method can be included. All the sheets must
+        have the same page size. The instrumentation, progress reporting and
+        cancellation of the first sheet are used for the whole document.
+    filelike: path or file-like object
+        The filename or file-like object to save the labels under. Any
+        existing contents will be overwritten.
+
+    Raises
+    ------
+    ValueError:
+        If no sheets are given or their page sizes differ.
+
+    """
+    sheets = list(sheets)
+    if not sheets:
+        raise ValueError("No sheets to save.")
+    for sheet in sheets[1:]:
+        if sheet._pagesize != sheets[0]._pagesize:
+            raise ValueError("All the sheets must have the same page size.")
+
+    # Close any checkpoint files, as saving a single sheet does, and shade any
+    # remaining missing labels if desired.
+    for sheet in sheets:
+        sheet.close_checkpoint()
+    sheets[0]._shade_remaining_missing()
+    sheets[0]._save_pages(filelike, 1, sheets[0].page_count, sheets[1:])
+
+
+def _fork_context():
+    """Get a multiprocessing context which starts processes by forking, or None
+    if this is not available. Not intended for external use.
+
+    """
+    import multiprocessing
+    if not hasattr(os, 'fork'):
+        return None
+    if hasattr(multiprocessing, 'get_context'):
+        return multiprocessing.get_context('fork')
+    return multiprocessing
+
+
+def _render_label(job):
+    """Render a label to an image in a worker process. Not intended for
+    external use.
+
+    """
+    from reportlab.graphics import renderPM
+    label, format, dpi, background_colour = job
+    return renderPM.drawToString(label, format, dpi, background_colour)
+
+
+class _LabelBatch(object):
+    """Collects the labels to be drawn by a batch drawing function. Not
+    intended for external use.
+
+    The sheet is given an empty drawing for each label to place. Copies of a
+    drawing share its list of contents, so when the batch is drawn the
+    contents are filled in and every copy of the label is updated.
+
+    """
+    def __init__(self, sheet, drawing_callable, size):
+        self.sheet = sheet
+        self.drawing_callable = drawing_callable
+        self.size = size
+        self.pending = []
+
+    def create(self, obj, context=None):
+        """Get the drawing for a label, queueing it to be drawn if it is not
+        in the cache.
+
+        """
+        from reportlab.graphics.shapes import Drawing
+        sheet = self.sheet
+        key = None
+        if sheet.cache:
+            key = sheet.cache.key(self.drawing_callable, sheet._geometry, sheet.cache_key(obj))
+            label = sheet.cache.get(key)
+            if label is not None:
+                return label
+        label = Drawing(float(sheet._lw), float(sheet._lh))
+        self.pending.append((obj, context, key, label))
+        return label
+
+    def full(self):
+        """Whether the batch is ready to be drawn. """
+        return len(self.pending) >= self.size
+
+    def flush(self):
+        """Draw the pending labels.
+
+        """
+        from reportlab.graphics.shapes import Drawing
+        if not self.pending:
+            return
+        sheet = self.sheet
+        pending, self.pending = self.pending, []
+
+        # Call the drawing function.
+        instrumentation = sheet.instrumentation
+        if instrumentation:
+            started = instrumentation.start()
+        objects = [item[0] for item in pending]
+        width, height = float(sheet._dw), float(sheet._dh)
+        if sheet.context:
+            drawings = self.drawing_callable(width, height, objects, [item[1] for item in pending])
+        else:
+            drawings = self.drawing_callable(width, height, objects)
+        drawings = list(drawings)
+        if len(drawings) != len(pending):
+            raise ValueError("The batch drawing function returned {0:d} drawings for {1:d} objects.".format(
+                len(drawings), len(pending)))
+
+        # Fill in the labels.
+        for (obj, context, key, label), drawing in zip(pending, drawings):
+            available = Drawing(width, height)
+            available.add(sheet._clip_drawing)
+            available.add(drawing)
+            sheet._finish_label(label, available)
+            if key is not None:
+                sheet.cache.put(key, label)
+        if instrumentation:
+            instrumentation.stop('drawing', started)
+
+
 class Sheet(object):
     """Create one or more sheets of labels.
 
     """
 
-    def __init__(self, specification, drawing_callable, pages_to_draw=None, border=False, shade_missing=False):
+    def __init__(self, specification, drawing_callable, pages_to_draw=None, border=False, shade_missing=False,
+                 instrument=False, progress=None, progress_interval=0.5, cancel=None,
+                 checkpoint=None, checkpoint_every=100, cache=None, cache_key=repr, images=None,
+                 fill_order='rows', context=False, seed=0):
         """
         Parameters
         ----------
@@ -48,7 +254,9 @@ class Sheet(object):
         pages_to_draw: list of positive integers, default None
             The list pages to actually draw labels on. This is intended to be
             used with the preview methods to avoid drawing labels that will
-            never be displayed. A value of None means draw all pages.
+            never be displayed. A value of None means draw all pages, and an
+            empty list means draw no labels at all (e.g., to find out how many
+            pages are needed).
         border: Boolean, default False
             Whether or not to draw a border around each label.
         shade_missing: Boolean or ReportLab colour, default False
@@ -57,6 +265,64 @@ class Sheet(object):
             ReportLab colour is given, the labels will be shaded in that colour.
             A value of True will result in the missing labels being shaded in
             the hex colour 0xBBBBBB (a medium-light grey).
+        instrument: Boolean or labels.Instrumentation instance, default False
+            Whether to record timings and counters while the labels are added
+            and the sheet saved or previewed. If True, a new Instrumentation
+            instance is created; an existing instance can be given to collect
+            the values from several sheets together. The instance is available
+            as the instrumentation attribute, which is None when disabled.
+        progress: callable, default None
+            A function to call with the progress of adding labels and saving
+            the sheet. It is given the name of the event, the current count,
+            and the total count (or None if unknown). See
+            labels.ProgressReporter for the events.
+        progress_interval: non-negative real, default 0.5
+            The minimum number of seconds between progress reports for each
+            event.
+        cancel: labels.CancellationToken, default None
+            A token which can be used to stop adding labels or saving. It is
+            checked before each label is placed and each page is rendered; if
+            it has been cancelled, a labels.Cancelled exception is raised. Any
+            labels placed before the cancellation remain on the sheet.
+        checkpoint: path, default None
+            A directory to periodically save the state of the sheet to, so an
+            interrupted run can be continued with the resume method. The
+            directory is created if needed.
+        checkpoint_every: positive integer, default 100
+            How many pages to complete between checkpoints.
+        cache: labels.LabelCache instance, default None
+            A persistent cache of label drawings. If given, labels found in the
+            cache are used without calling the drawing function, and new labels
+            are added to it. A lambda or closure drawing function can only be
+            cached if the cache has a version.
+        cache_key: callable, default repr
+            A function which converts an object to a string identifying what
+            is drawn on its label. Objects with the same key must produce the
+            same label.
+        images: labels.ImageRegistry instance, default None
+            The registry of images for the drawing function to use, available
+            as the images attribute. If None, a new registry is created. A
+            registry can be shared between sheets.
+        fill_order: string, callable or sequence, default 'rows'
+            The order to fill the labels on each page in. This can be 'rows'
+            (left to right along each row, from the top row down), 'columns'
+            (top to bottom down each column, from the left column across),
+            'serpentine' (along the rows, alternating direction on each row),
+            or 'serpentine_columns' (down the columns, alternating direction).
+            Alternatively, give a sequence of every (row, column) position in
+            the order to fill them, or a callable which is given the number of
+            rows and columns and returns such a sequence. Used labels marked
+            through partial_page are skipped as normal.
+        context: Boolean, default False
+            Whether to give the drawing function a fifth parameter, a
+            labels.LabelContext instance with the number of the label, where
+            it is placed, and a random number generator seeded from its
+            number. Drawing functions which only use these (and the object) to
+            draw the label give the same output however the sheet is split up.
+            A cache cannot be used with a context.
+        seed: integer, default 0
+            The seed combined with the label number to seed the random number
+            generator of each label context.
 
         Notes
         -----
@@ -67,9 +333,13 @@ class Sheet(object):
         scripts, the colours for each label are picked by a pseduo-random number
         generator. However, in the preview script, this generator is not
         advanced and so the colours on the last page differ between the preview
-        and the actual output.
+        and the actual output. Use the random number generator from the label
+        context (see the context parameter) to avoid this.
 
         """
+        from reportlab.graphics.shapes import Drawing, ArcPath, Image
+        from reportlab.lib import colors
+
         # Save our arguments.
         specification._calculate()
         self.specs = deepcopy(specification)
@@ -80,6 +350,26 @@ class Sheet(object):
             self.shade_missing = colors.HexColor(0xBBBBBB)
         else:
             self.shade_missing = shade_missing
+        if instrument is True:
+            self.instrumentation = Instrumentation()
+        else:
+            self.instrumentation = instrument or None
+        if progress:
+            self.progress = ProgressReporter(progress, progress_interval)
+        else:
+            self.progress = None
+        self.cancel = cancel
+        self.checkpoint = checkpoint
+        self.checkpoint_every = checkpoint_every
+        self.cache = cache
+        self.cache_key = cache_key
+        self.images = ImageRegistry() if images is None else images
+        self.context = context
+        self.seed = seed
+        if context and cache:
+            raise ValueError("A label cache cannot be used with a label context.")
+        if cache:
+            cache.check(drawing_callable)
 
         # Set up some internal variables.
         self._lw = self.specs.label_width * mm
@@ -90,16 +380,36 @@ class Sheet(object):
         self._lp = self.specs.left_padding * mm
         self._bp = self.specs.bottom_padding * mm
         self._pr = self.specs.padding_radius * mm
-        self._used = {}
+        self._geometry = tuple(float(v) for v in (self._lw, self._lh, self._cr, self._dw, self._dh,
+                                                  self._lp, self._bp, self._pr)) + (bool(border),)
+        self._used = UsedLabels(self.specs.rows, self.specs.columns)
+        self._shaded = 0
         self._pages = []
+        self._shaded_label = None
         self._current_page = None
 
         # Page information.
         self._pagesize = (float(self.specs.sheet_width*mm), float(self.specs.sheet_height*mm))
-        self._numlabels = [self.specs.rows, self.specs.columns]
-        self._position = [1, 0]
+        self._labels_per_page = self.specs.rows * self.specs.columns
+        self._order = fill_positions(fill_order, self.specs.rows, self.specs.columns)
+        self._order_indices = [self._used.index(*position) for position in self._order]
+        self._step = -1
+        self._position = None
+        self._page_used = 0
         self.label_count = 0
         self.page_count = 0
+        self._page_starts = []
+        self._changed_pages = set()
+
+        # Checkpoint information.
+        self._skip_labels = 0
+        self._resumed_pages = 0
+        self._checkpoint_pages = 0
+        self._checkpoint_segment = None
+        self._checkpoint_segments = []
+
+        # The batch of labels being drawn by add_labels, if any.
+        self._batch = None
 
         # Background image.
         if self.specs.background_image:
@@ -117,9 +427,11 @@ class Sheet(object):
             else:
                 raise ValueError("Unhandled background type.")
 
-        # Background from a filename.
+        # Background from a filename. This goes through the image registry so
+        # the file is only embedded once however many pages there are.
         elif self.specs.background_filename:
-            self._bgimage = Image(0, 0, self._pagesize[0], self._pagesize[1], self.specs.background_filename)
+            self._bgimage = self.images.image(self.specs.background_filename, 0, 0,
+                                              self._pagesize[0], self._pagesize[1])
 
         # No background.
         else:
@@ -219,35 +531,64 @@ class Sheet(object):
             sheet.
 
         """
+        # Pages restored from a checkpoint already include their used labels.
+        if page <= self._resumed_pages:
+            return
+
         # Check the page number is valid.
         if page <= self.page_count:
             raise ValueError("Page {0:d} has already started, cannot mark used labels now.".format(page))
 
         # Add these to any existing labels marked as used.
-        used = self._used.get(page, set())
-        for row, column in used_labels:
-            # Check the index is valid.
-            if row < 1 or row > self.specs.rows:
-                raise IndexError("Invalid row number: {0:d}.".format(row))
-            if column < 1 or column > self.specs.columns:
-                raise IndexError("Invalid column number: {0:d}.".format(column))
+        self._used.add(page, used_labels)
 
-            # Add it.
-            used.add((int(row), int(column)))
+    def partial_pages(self, used):
+        """Mark labels on several pages as already used, e.g., from an
+        inventory of partially used sheets.
+
+        Parameters
+        ----------
+        used: labels.UsedLabels instance or dictionary
+            The used labels, either as a UsedLabels record (which can be
+            loaded from a file with its load method) or a dictionary mapping
+            page numbers to iterables of (row, column) pairs. The same
+            restrictions apply to each page as for partial_page.
 
-        # Save the details.
-        self._used[page] = used
+        """
+        if isinstance(used, UsedLabels):
+            used = dict((page, used.positions(page)) for page in used.pages())
+        for page in sorted(used):
+            self.partial_page(page, used[page])
 
     def _new_page(self):
         """Helper function to start a new page. Not intended for external use.
 
         """
+        from reportlab.graphics.shapes import Drawing
+
+        # The previous page (if any) is now complete.
+        if self.progress and self.page_count:
+            self.progress.report('pages', self.page_count)
+        if self.checkpoint and (self.page_count - self._checkpoint_pages) >= self.checkpoint_every:
+            self.save_checkpoint()
+
         self._current_page = Drawing(*self._pagesize)
         if self._bgimage:
             self._current_page.add(self._bgimage)
         self._pages.append(self._current_page)
+        self._page_starts.append(self.label_count)
         self.page_count += 1
-        self._position = [1, 0]
+        self._step = -1
+        self._position = None
+        self._shaded = 0
+
+        # Find the used labels on the new page in the order they are filled.
+        mask = self._used.mask(self.page_count)
+        self._page_used = 0
+        if mask:
+            for step, index in enumerate(self._order_indices):
+                if mask >> index & 1:
+                    self._page_used |= 1 << step
 
     def _next_label(self):
         """Helper method to move to the next label. Not intended for external use.
@@ -257,21 +598,46 @@ class Sheet(object):
         partial_pages). See _next_unused_label for generally more useful method.
 
         """
-        # Special case for the very first label.
-        if self.page_count == 0:
+        # Start a new page for the very first label or if this one is full.
+        if self._page_full():
             self._new_page()
 
-        # Filled up a page.
-        elif self._position == self._numlabels:
-            self._new_page()
+        # Step to the next position in the fill order.
+        self._step += 1
+        self._position = self._order[self._step]
 
-        # Filled up a row.
-        elif self._position[1] == self.specs.columns:
-            self._position[0] += 1
-            self._position[1] = 0
+    def _page_full(self):
+        """Helper method to check if the current page (if any) has no more
+        labels available. Not intended for external use.
 
-        # Move to the next column.
-        self._position[1] += 1
+        """
+        return self.page_count == 0 or self._step == self._labels_per_page - 1
+
+    def _fill_page(self):
+        """Helper method to start a new page and mark all of its labels as
+        used. Not intended for external use.
+
+        The caller is responsible for adding the labels to the page, and must
+        ensure the page has no missing labels.
+
+        """
+        self._new_page()
+        self._step = self._labels_per_page - 1
+        self._position = self._order[self._step]
+        self.label_count += self._labels_per_page
+
+    def _full_page_group(self, label):
+        """Helper method to create a group with a copy of the given label in
+        every position on a page. Not intended for external use.
+
+        """
+        from reportlab.graphics.shapes import Group
+        group = Group()
+        for position in self._order:
+            thislabel = copy(label)
+            thislabel.shift(*self._calculate_edges(position))
+            group.add(thislabel)
+        return group
 
     def _next_unused_label(self):
         """Helper method to move to the next unused label. Not intended for external use.
@@ -284,99 +650,223 @@ class Sheet(object):
         self._next_label()
 
         # This label may be missing.
-        if self.page_count in self._used:
-            # Keep try while the label is missing.
-            missing = self._used.get(self.page_count, set())
-            while tuple(self._position) in missing:
-                # Throw the missing information away now we have used it. This
-                # allows the _shade_remaining_missing method to work.
-                missing.discard(tuple(self._position))
-
-                # Shade the missing label if desired.
-                if self.shade_missing:
-                    self._shade_missing_label()
-
-                # Try our luck with the next label.
-                self._next_label()
-                missing = self._used.get(self.page_count, set())
+        while self._page_used >> self._step & 1:
+            # Find the next free step on this page.
+            free = ~self._page_used >> self._step & ((1 << (self._labels_per_page - self._step)) - 1)
+            if free:
+                free = self._step + (free & -free).bit_length() - 1
+            else:
+                free = self._labels_per_page
+
+            # Shade the missing labels we skip over if desired.
+            if self.shade_missing:
+                for step in range(self._step, free):
+                    self._shade_missing_label(self._order[step])
+
+            # Move to the free label, or on to the next page if there are none.
+            self._step = free - 1
+            self._next_label()
 
         # Increment the count now we have found a suitable position.
         self.label_count += 1
 
-    def _calculate_edges(self):
-        """Calculate edges of the current label. Not intended for external use.
-
+    def _calculate_edges(self, position=None):
+        """Calculate edges of the current label, or of the label at the given
+        (row, column) position. Not intended for external use.
 
         """
+        if position is None:
+            position = self._position
+
         # Calculate the left edge of the label.
         left = self.specs.left_margin
-        left += (self.specs.label_width * (self._position[1] - 1))
+        left += (self.specs.label_width * (position[1] - 1))
         if self.specs.column_gap:
-            left += (self.specs.column_gap * (self._position[1] - 1))
+            left += (self.specs.column_gap * (position[1] - 1))
         left *= mm
 
         # And the bottom.
         bottom = self.specs.sheet_height - self.specs.top_margin
-        bottom -= (self.specs.label_height * self._position[0])
+        bottom -= (self.specs.label_height * position[0])
         if self.specs.row_gap:
-            bottom -= (self.specs.row_gap * (self._position[0] - 1))
+            bottom -= (self.specs.row_gap * (position[0] - 1))
         bottom *= mm
 
         # Done.
         return float(left), float(bottom)
 
-    def _shade_missing_label(self):
-        """Helper method to shade a missing label. Not intended for external use.
+    def _missing_label(self, position):
+        """Helper method to create a shaded missing label at the given
+        position. Not intended for external use.
 
         """
-        # Start a drawing for the whole label.
-        label = Drawing(float(self._lw), float(self._lh))
-        label.add(self._clip_label)
+        # The shaded label is the same every time, so we only need to create
+        # it once. Sharing it also lets save() spot identical pages.
+        if self._shaded_label is None:
+            from reportlab.graphics.shapes import Drawing, Rect
+
+            # Start a drawing for the whole label.
+            label = Drawing(float(self._lw), float(self._lh))
+            label.add(self._clip_label)
+
+            # Fill with a rectangle; the clipping path will take care of the borders.
+            r = Rect(0, 0, float(self._lw), float(self._lh))
+            r.fillColor = self.shade_missing
+            r.strokeColor = None
+            label.add(r)
+            self._shaded_label = label
+
+        # Place a copy of it.
+        label = copy(self._shaded_label)
+        label.shift(*self._calculate_edges(position))
+        return label
+
+    def _shade_missing_label(self, position=None):
+        """Helper method to shade a missing label, defaulting to the current
+        one. Not intended for external use.
 
-        # Fill with a rectangle; the clipping path will take care of the borders.
-        r = shapes.Rect(0, 0, float(self._lw), float(self._lh))
-        r.fillColor = self.shade_missing
-        r.strokeColor = None
-        label.add(r)
+        """
+        # Add the label to the page, and note it has been shaded.
+        if position is None:
+            position = self._position
+        self._current_page.add(self._missing_label(position))
+        self._shaded |= 1 << self._used.index(*position)
 
-        # Add the label to the page.
-        label.shift(*self._calculate_edges())
-        self._current_page.add(label)
+    def _remaining_missing(self):
+        """Helper method to get the positions of the missing labels on the
+        current page which have not been shaded yet, in fill order. Not
+        intended for external use.
+
+        """
+        if not self.shade_missing or not self.page_count:
+            return []
+        remaining = self._used.mask(self.page_count) & ~self._shaded
+        return [position for position, index in zip(self._order, self._order_indices) if remaining >> index & 1]
 
     def _shade_remaining_missing(self):
         """Helper method to shade any missing labels remaining on the current
         page. Not intended for external use.
 
-        Note that this will modify the internal _position attribute and should
-        therefore only be used once all the 'real' labels have been drawn.
+        Labels which have already been shaded are skipped, so this can be
+        called more than once.
 
         """
-        # Sanity check.
-        if not self.shade_missing:
-            return
-
         # Run through each missing label left in the current page and shade it.
-        missing = self._used.get(self.page_count, set())
-        for position in missing:
-            self._position = position
-            self._shade_missing_label()
+        for position in self._remaining_missing():
+            self._shade_missing_label(position)
 
-    def _draw_label(self, obj, count):
-        """Helper method to draw on the current label. Not intended for external use.
+    def _image_page(self, page):
+        """Helper method to get a copy of a page for rendering to an image. Not
+        intended for external use.
+
+        ReportLab's renderers store temporary attributes on each node they
+        draw, and the nodes of a label are shared by all its copies. Each
+        render is therefore given its own shallow copy of every group and
+        shape on the page. The copy has any remaining missing labels on the
+        last page shaded, and a ReportLab Image background given the integer
+        size that rendering to an image requires. The sheet is not changed, so
+        several pages can be rendered at the same time from different threads.
 
         """
-        # Start a drawing for the whole label.
-        label = Drawing(float(self._lw), float(self._lh))
-        label.add(self._clip_label)
+        from reportlab.graphics.shapes import Image
+
+        def detach(node):
+            copied = copy(node)
+            copied.__dict__.pop('_canvas', None)
+            copied.__dict__.pop('_parent', None)
+            if node is self._bgimage and isinstance(node, Image):
+                copied.width = int(node.width) + 1
+                copied.height = int(node.height) + 1
+            contents = getattr(node, 'contents', None)
+            if contents is not None:
+                copied.contents = [detach(child) for child in contents]
+            return copied
+
+        drawing = detach(self._pages[page-1])
+        if page == self.page_count:
+            for position in self._remaining_missing():
+                drawing.add(detach(self._missing_label(position)))
+        return drawing
+
+    def _page_key(self, page):
+        """Helper method to get a key describing the composition of a page.
+        Not intended for external use.
+
+        Two pages with the same key contain the same drawings at the same
+        positions. Copies of a label share their contents, so they are
+        identified by the contents and the transform used to place them.
+
+        """
+        key = []
+        for item in page.contents:
+            contents = getattr(item, 'contents', item)
+            transform = getattr(item, 'transform', None)
+            key.append((id(contents), tuple(transform) if transform else None))
+        return tuple(key)
+
+    def _label_context(self, label):
+        """Helper method to create the context for a label which has been
+        placed. Not intended for external use.
 
-        # And one for the available area (i.e., after padding).
+        """
+        page, position = self._label_location(label)
+        return LabelContext(label, page, position[0], position[1], self.seed)
+
+    def _label_location(self, label):
+        """Helper method to find the page and (row, column) position of a
+        label which has been placed. Not intended for external use.
+
+        """
+        page = bisect_left(self._page_starts, label)
+        return page, self._label_positions(page)[label - self._page_starts[page-1] - 1]
+
+    def _create_label(self, obj, context=None):
+        """Helper method to create the drawing for a label. Not intended for
+        external use.
+
+        """
+        # Use the cached drawing if there is one.
+        cache = self.cache
+        if cache:
+            key = cache.key(self.drawing_callable, self._geometry, self.cache_key(obj))
+            label = cache.get(key)
+            if label is not None:
+                return label
+
+        from reportlab.graphics.shapes import Drawing
+        instrumentation = self.instrumentation
+        if instrumentation:
+            started = instrumentation.start()
+
+        # Start a drawing for the available area (i.e., after padding).
         available = Drawing(float(self._dw), float(self._dh))
         available.add(self._clip_drawing)
 
         # Call the drawing function.
-        self.drawing_callable(available, float(self._dw), float(self._dh), obj)
+        if self.context:
+            self.drawing_callable(available, float(self._dw), float(self._dh), obj, context)
+        else:
+            self.drawing_callable(available, float(self._dw), float(self._dh), obj)
 
+        # Put it on a drawing for the whole label.
+        label = Drawing(float(self._lw), float(self._lh))
+        self._finish_label(label, available)
+        if instrumentation:
+            instrumentation.stop('drawing', started)
+
+        # Store it for next time.
+        if cache:
+            cache.put(key, label)
+
+        return label
+
+    def _finish_label(self, label, available):
+        """Helper method to add the drawing of the available area of a label to
+        the (empty) drawing for the whole label. Not intended for external use.
+
+        """
         # Render the contents on the label.
+        label.add(self._clip_label)
         available.shift(float(self._lp), float(self._bp))
         label.add(available)
 
@@ -384,21 +874,104 @@ class Sheet(object):
         if self.border:
             label.add(self._border)
 
+    def _draw_label(self, obj, count):
+        """Helper method to draw on the current label. Not intended for external use.
+
+        """
+        # The number of the first copy of this label.
+        first = self.label_count - self._skip_labels + 1
+
+        # Skip any copies which were placed before the sheet was resumed from
+        # a checkpoint.
+        if self._skip_labels:
+            skipped = min(count, self._skip_labels)
+            self._skip_labels -= skipped
+            count -= skipped
+            if not count:
+                return
+
+        # Stop now if we have been cancelled.
+        cancel = self.cancel
+        if cancel:
+            cancel.check()
+
+        # Creating the label records the time taken to draw it (as does a
+        # batch when it is drawn), so leave it out of the placement time.
+        instrumentation = self.instrumentation
+        if instrumentation:
+            started = instrumentation.start()
+            placing = [started]
+        make = self._batch.create if self._batch else self._create_label
+
+        def create(obj, context=None):
+            if instrumentation:
+                instrumentation.stop('placement', placing[0], call=False)
+            label = make(obj, context)
+            if instrumentation:
+                placing[0] = instrumentation.start()
+            return label
+
+        # Create the label. If only some pages are being drawn, wait until a
+        # copy is placed on one of them so the drawing function is only called
+        # for labels which will be shown. A context needs the position of the
+        # first copy, so also wait until that has been placed.
+        label = None
+        if self.pages_to_draw is None and not self.context:
+            label = create(obj)
+
         # Add however many copies we need to.
-        for i in range(count):
+        full_page = None
+        while count > 0:
+            if cancel:
+                cancel.check()
+
+            # If we are about to start a page with no missing labels and have
+            # enough copies left to fill it, fill the whole page in one step.
+            if count >= self._labels_per_page and self._page_full() and (self.page_count + 1) not in self._used:
+                self._fill_page()
+                count -= self._labels_per_page
+
+                # Have we been told to skip this page?
+                if self.pages_to_draw is not None and self.page_count not in self.pages_to_draw:
+                    continue
+
+                # The contents of a full page are the same every time, so
+                # create them once and add them to each page by reference.
+                if full_page is None:
+                    if label is None:
+                        label = create(obj, self._label_context(first) if self.context else None)
+                    full_page = self._full_page_group(label)
+                self._current_page.add(full_page)
+                continue
+
             # Find the next available label.
             self._next_unused_label()
+            count -= 1
 
             # Have we been told to skip this page?
-            if self.pages_to_draw and self.page_count not in self.pages_to_draw:
+            if self.pages_to_draw is not None and self.page_count not in self.pages_to_draw:
                 continue
 
             # Add the label to the page. ReportLab stores the added drawing by
             # reference so we have to copy it N times.
+            if label is None:
+                label = create(obj, self._label_context(first) if self.context else None)
             thislabel = copy(label)
             thislabel.shift(*self._calculate_edges())
             self._current_page.add(thislabel)
 
+        # Record how long the placement took.
+        if instrumentation:
+            instrumentation.stop('placement', placing[0])
+            instrumentation.label(obj, started)
+        if self.progress:
+            self.progress.report('labels', self.label_count)
+
+        # Draw the batch of labels once it is full. The copies share the
+        # contents of the label, so they are all filled in.
+        if self._batch and self._batch.full():
+            self._batch.flush()
+
     def add_label(self, obj, count=1):
         """Add a label to the sheet.
 
@@ -411,12 +984,91 @@ class Sheet(object):
             How many copies of the label to add to the sheet. Note that the
             drawing function will only be called once and the results copied
             for each label. If the drawing function maintains any state
-            internally then using this parameter may break it.
+            internally then using this parameter may break it. Pages which are
+            completely filled by the copies (and have no missing labels) are
+            added in a single step and share the same contents, so large
+            counts cost time in proportion to the number of pages.
 
         """
         self._draw_label(obj, count)
 
-    def add_labels(self, objects, count=1):
+    def update_label(self, label, obj):
+        """Replace the object drawn on a label which has already been added.
+
+        Only the page containing the label is changed; the drawing function is
+        called once for the new object and the rest of the sheet is left as it
+        is. The page is recorded as changed so that save_shards can rewrite
+        just the affected shard. The drawing function of the sheet is used even
+        if the labels were added with a batch callable.
+
+        Parameters
+        ----------
+        label: positive integer
+            The number of the label to replace. Labels are numbered from 1 in
+            the order they were added, with each copy from the count parameter
+            being a separate label. This is the same numbering as used by the
+            manifest from save_shards.
+        obj:
+            The new object to draw on the label.
+
+        Returns
+        -------
+        The number of the page the label is on.
+
+        Raises
+        ------
+        IndexError:
+            If the label number is not valid.
+
+        """
+        # Check the label number.
+        if label < 1 or label > self.label_count:
+            raise IndexError("Invalid label number: {0:d}.".format(label))
+
+        # Find which page it is on and its position within the page.
+        page, position = self._label_location(label)
+
+        # If the page is not being drawn, there is nothing to replace.
+        if self.pages_to_draw is not None and page not in self.pages_to_draw:
+            return page
+
+        # Create the new label.
+        thislabel = self._create_label(obj, self._label_context(label) if self.context else None)
+        edges = self._calculate_edges(position)
+        thislabel.shift(*edges)
+
+        # Find and replace the old label. Any full page groups are expanded
+        # into their individual labels first; this leaves the group itself
+        # untouched for any other pages sharing it.
+        from reportlab.graphics.shapes import Group
+        contents = []
+        for item in self._pages[page-1].contents:
+            if type(item) is Group:
+                contents.extend(item.contents)
+            else:
+                contents.append(item)
+        for index, item in enumerate(contents):
+            if item is self._bgimage or getattr(item, 'contents', None) is getattr(self._shaded_label, 'contents', False):
+                continue
+            transform = getattr(item, 'transform', None)
+            if transform and tuple(transform[4:]) == edges:
+                contents[index] = thislabel
+                break
+        self._pages[page-1].contents = contents
+
+        # Done.
+        self._changed_pages.add(page)
+        return page
+
+    def _label_positions(self, page):
+        """Helper method to get the positions of the labels on a page in the
+        order they are filled. Not intended for external use.
+
+        """
+        mask = self._used.mask(page)
+        return [position for position, index in zip(self._order, self._order_indices) if not mask >> index & 1]
+
+    def add_labels(self, objects, count=1, collapse=False, batch_callable=None, batch_size=100):
         """Add multiple labels to the sheet.
 
         Parameters
@@ -439,8 +1091,70 @@ class Sheet(object):
             and the results copied for the repeats. If the drawing function
             maintains any state internally then using this parameter may break
             it.
+        collapse: Boolean or callable, default False
+            Whether to merge runs of consecutive identical objects into a
+            single label. If True, consecutive objects which compare equal are
+            drawn once and repeated for the total of their counts. If a
+            callable, it is used as a key function and consecutive objects with
+            equal keys are merged; the first object of each run is the one
+            passed to the drawing function. The objects are still processed as
+            a stream, with only the current run held in memory. The same
+            warning as for count applies to drawing functions which maintain
+            internal state.
+        batch_callable: callable, default None
+            A function to draw the labels in batches instead of calling the
+            drawing function of the sheet for each one. This suits work which
+            is cheaper in bulk, such as generating many barcodes at once or
+            looking up the details of the objects with a single database query.
+            It is given the width and height of the available area of a label
+            in points and a list of objects, and must return a list (or other
+            iterable) with a ReportLab shape for each object, in order. Each
+            shape is drawn on its label as if it had been added to the drawing
+            given to a normal drawing function (a Drawing or Group can be used
+            to return several shapes). If the sheet has a context, the list of
+            labels.LabelContext instances for the objects is given as a fourth
+            parameter.
+        batch_size: positive integer, default 100
+            The most objects to give to the batch callable at once. The labels
+            are placed as the objects are read, but are only drawn when the
+            batch is full (or the objects run out), so this also bounds how
+            many objects are held in memory.
+
+        Raises
+        ------
+        ValueError:
+            If the batch size is not positive, or the batch callable returns
+            the wrong number of shapes.
+
+        Notes
+        -----
+        As with the drawing function of the sheet, the batch callable is only
+        given the objects for labels on pages which are being drawn, and each
+        object is only given once however many copies of its label there are.
+        If a cache is used, objects whose labels are in the cache are not
+        passed to the batch callable; the cache key includes the batch
+        callable rather than the drawing function of the sheet.
+
+        The batch callable is only used while adding these labels. Labels
+        replaced with update_label, and the objects given to export_labels,
+        are drawn with the drawing function of the sheet.
 
         """
+        # Draw the labels in batches if requested. Any labels waiting to be
+        # drawn when we stop (including when cancelled) are drawn at the end.
+        if batch_callable is not None:
+            if batch_size < 1:
+                raise ValueError("The batch size must be at least 1.")
+            if self.cache:
+                self.cache.check(batch_callable)
+            batch = self._batch = _LabelBatch(self, batch_callable, batch_size)
+            try:
+                self.add_labels(objects, count, collapse)
+            finally:
+                self._batch = None
+                batch.flush()
+            return
+
         # If we can convert it to an int, do so and use the itertools.repeat()
         # method to create an infinite iterator from it. Otherwise, assume it
         # is an iterable or sequence.
@@ -456,7 +1170,24 @@ class Sheet(object):
         if not hasattr(count, 'next') and not hasattr(count, '__next__'):
             count = iter(count)
 
-        # Go through the objects.
+        # Without collapsing, each object is drawn as soon as we get it.
+        if not collapse:
+            for obj in objects:
+                # Check we have a count for this one.
+                try:
+                    thiscount = next(count)
+                except StopIteration:
+                    break
+
+                # Draw it.
+                self._draw_label(obj, thiscount)
+            self._report_added()
+            return
+
+        # Otherwise, keep hold of the current run of objects until one with a
+        # different key comes along.
+        key = collapse if callable(collapse) else None
+        run_obj, run_key, run_count = None, None, 0
         for obj in objects:
             # Check we have a count for this one.
             try:
@@ -464,10 +1195,37 @@ class Sheet(object):
             except StopIteration:
                 break
 
-            # Draw it.
-            self._draw_label(obj, thiscount)
+            # Part of the current run.
+            thiskey = key(obj) if key else obj
+            if run_count and thiskey == run_key:
+                run_count += thiscount
+                continue
+
+            # Start of a new run; draw the previous one.
+            if run_count:
+                self._draw_label(run_obj, run_count)
+            run_obj, run_key, run_count = obj, thiskey, thiscount
 
-    def save(self, filelike):
+        # Draw the final run.
+        if run_count:
+            self._draw_label(run_obj, run_count)
+
+        # Make sure the final progress is reported.
+        self._report_added()
+
+    def _report_added(self):
+        """Helper method to report the progress at the end of adding labels.
+        Not intended for external use.
+
+        """
+        if self.progress:
+            self.progress.report('labels', self.label_count, force=True)
+            if self._page_full() and self.page_count:
+                self.progress.report('pages', self.page_count, force=True)
+            elif self.page_count > 1:
+                self.progress.report('pages', self.page_count - 1, force=True)
+
+    def save(self, filelike, stream=False, pages=None):
         """Save the file as a PDF.
 
         Parameters
@@ -475,21 +1233,508 @@ class Sheet(object):
         filelike: path or file-like object
             The filename or file-like object to save the labels under. Any
             existing contents will be overwritten.
+        stream: Boolean, default False
+            Whether to write each page to the file as soon as it has been
+            rendered, rather than writing the whole PDF at the end. This
+            reduces the memory needed for large sheets, and the file-like
+            object does not need to be seekable (e.g., a socket or a web
+            response). The fonts, shared forms and the index of the file are
+            still written at the end.
+        pages: tuple of two positive integers, default None
+            The first and last page to save. If None, every page is saved. Use
+            label_range() to find which labels are on the saved pages.
+
+        Raises
+        ------
+        ValueError:
+            If the page range is not valid.
+
+        Notes
+        -----
+        Pages with identical contents (the same labels in the same positions
+        with the same shading, such as those created from a large count) are
+        only rendered once. The rendered page is stored in the PDF as a form
+        XObject which each of the identical pages references.
+
+        """
+        # Check the range before changing anything.
+        first, last = 1, self.page_count
+        if pages is not None:
+            first, last = pages
+            self._check_page_range(first, last)
+
+        # Close any checkpoint file, and shade any remaining missing labels if
+        # desired.
+        self.close_checkpoint()
+        self._shade_remaining_missing()
+
+        # Save the pages.
+        self._save_pages(filelike, first, last, stream=stream)
+
+    def _check_page_range(self, first, last):
+        """Helper method to check a range of pages exists. Not intended for
+        external use.
+
+        """
+        if first < 1 or last < first or last > self.page_count:
+            raise ValueError("Invalid page range {0:d} to {1:d}; the pages are numbered 1 to {2:d}.".format(
+                first, last, self.page_count))
+
+    def label_range(self, first, last=None):
+        """Get the numbers of the first and last labels on a range of pages.
+
+        Parameters
+        ----------
+        first, last: positive integers
+            The (inclusive) range of pages. If last is None, just the first
+            page is used.
+
+        Returns
+        -------
+        A tuple of the numbers of the first and last labels, or None if there
+        are no labels on the pages. Labels are numbered from 1 in the order
+        they were added, as for update_label.
+
+        Raises
+        ------
+        ValueError:
+            If the page range is not valid.
+
+        """
+        if last is None:
+            last = first
+        self._check_page_range(first, last)
+        first_label, last_label = self._page_labels(first)[0], self._page_labels(last)[1]
+        if first_label > last_label:
+            return None
+        return first_label, last_label
+
+    def iter_pdf(self):
+        """Generator which renders the PDF a page at a time, yielding the data
+        as it is produced.
+
+        This can be used to send the PDF to a client while it is being
+        created, e.g., with the StreamingHttpResponse class of the Django web
+        framework. See the stream parameter of save() for details.
+
+        Yields
+        ------
+        Byte strings of the PDF, in order.
+
+        """
+        from .streaming import ChunkBuffer
+
+        # Close any checkpoint file, and shade any remaining missing labels if
+        # desired.
+        self.close_checkpoint()
+        self._shade_remaining_missing()
+
+        # Pass on the data written for each page, and then the rest.
+        buffer = ChunkBuffer()
+        for done in self._iter_save(buffer, 1, self.page_count, stream=True):
+            data = buffer.take()
+            if data:
+                yield data
+        data = buffer.take()
+        if data:
+            yield data
+
+    def save_checkpoint(self):
+        """Save the completed pages and the state of the sheet to the
+        checkpoint directory.
+
+        This is called automatically every checkpoint_every pages, but can be
+        called manually at any time. Only complete pages are included; labels
+        on the current page will be placed again when the run is resumed.
+        Pages are appended to the checkpoint rather than rewritten, so the cost
+        depends on the number of pages completed since the last checkpoint.
+
+        Notes
+        -----
+        The pages are stored with the pickle module, so everything the drawing
+        function adds to the labels must be picklable.
+
+        Raises
+        ------
+        ValueError:
+            If the sheet has no checkpoint directory.
+
+        """
+        import pickle
+        if not self.checkpoint:
+            raise ValueError("No checkpoint directory was given.")
+        if not os.path.isdir(self.checkpoint):
+            os.makedirs(self.checkpoint)
+
+        # Labels waiting for a batch drawing function must be drawn before
+        # their pages are stored.
+        if self._batch:
+            self._batch.flush()
+
+        # Only complete pages are saved.
+        complete = self.page_count if self._page_full() else self.page_count - 1
+        if complete < self._checkpoint_pages:
+            return
+
+        # Each run appends to its own segment file. Using the same pickler for
+        # all of a segment means objects shared between pages (backgrounds,
+        # full-page groups etc) are only stored once.
+        if self._checkpoint_segment is None:
+            filename = 'pages-{0:04d}.pkl'.format(len(self._checkpoint_segments) + 1)
+            f = open(os.path.join(self.checkpoint, filename), 'wb')
+            self._checkpoint_segment = (f, pickle.Pickler(f, pickle.HIGHEST_PROTOCOL))
+            self._checkpoint_segments.append({'filename': filename, 'pages': 0})
+        f, pickler = self._checkpoint_segment
+        for page in self._pages[self._checkpoint_pages:complete]:
+            pickler.dump(page)
+        f.flush()
+        os.fsync(f.fileno())
+        self._checkpoint_segments[-1]['pages'] += complete - self._checkpoint_pages
+        self._checkpoint_pages = complete
+
+        # Now the pages are safely stored, save the state at the end of the
+        # last of them. If we are interrupted before this is replaced, the
+        # previous state is still valid as it ignores any extra pages.
+        if complete < self.page_count:
+            labels = self._page_starts[complete]
+        else:
+            labels = self.label_count
+        state = {
+            'version': 1,
+            'label_count': labels,
+            'page_count': complete,
+            'page_starts': self._page_starts[:complete],
+            'used': dict((str(page), used) for page, used in self._used.as_dict().items()),
+            'segments': self._checkpoint_segments,
+        }
+        filename = os.path.join(self.checkpoint, 'state.json')
+        with open(filename + '.tmp', 'w') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(filename + '.tmp', filename)
+
+    def close_checkpoint(self):
+        """Close the file the checkpointed pages are being appended to.
+
+        This is called automatically when the sheet is saved, including with
+        labels.save_merged. If more pages
+        are checkpointed afterwards, they are stored in a new file.
+
+        """
+        if self._checkpoint_segment is not None:
+            self._checkpoint_segment[0].close()
+            self._checkpoint_segment = None
+
+    def resume(self):
+        """Resume an interrupted run from the checkpoint directory.
+
+        The sheet must be set up the same way as for the interrupted run,
+        including any calls to partial_page, and no labels can have been added
+        yet. After resuming, add the same objects (with the same counts) as the
+        original run; the labels which were already placed are skipped without
+        calling the drawing function. Calls to partial_page for pages which
+        were restored are ignored. The result is the same as if the run had not
+        been interrupted.
+
+        Returns
+        -------
+        The number of labels which will be skipped, or zero if there was no
+        checkpoint to resume from.
+
+        Raises
+        ------
+        ValueError:
+            If the sheet has no checkpoint directory, or labels have already
+            been added.
+
+        """
+        import pickle
+        if not self.checkpoint:
+            raise ValueError("No checkpoint directory was given.")
+        if self.page_count:
+            raise ValueError("Cannot resume once labels have been added.")
+
+        # Nothing saved yet.
+        filename = os.path.join(self.checkpoint, 'state.json')
+        if not os.path.exists(filename):
+            return 0
+        with open(filename) as f:
+            state = json.load(f)
+
+        # Load the pages which the state covers from each segment.
+        pages = []
+        for segment in state['segments']:
+            with open(os.path.join(self.checkpoint, segment['filename']), 'rb') as f:
+                unpickler = pickle.Unpickler(f)
+                for i in range(segment['pages']):
+                    pages.append(unpickler.load())
+
+        # Each page starts with the background. Use this sheet's own copy so a
+        # registered background image is still only embedded once.
+        if self._bgimage:
+            for page in pages:
+                page.contents[0] = self._bgimage
+
+        # Restore the state as at the end of the last page.
+        self._pages = pages
+        self._page_starts = state['page_starts']
+        self.page_count = state['page_count']
+        self.label_count = state['label_count']
+        self._current_page = pages[-1] if pages else None
+        self._step = self._labels_per_page - 1 if pages else -1
+        self._position = self._order[self._step] if pages else None
+        self._page_used = 0
+        self._used = UsedLabels(self.specs.rows, self.specs.columns)
+        for page, used in state['used'].items():
+            self._used.add(int(page), used)
+
+        # The restored pages are complete, so any missing labels on the last
+        # of them have already been shaded.
+        self._shaded = self._used.mask(self.page_count) if pages else 0
+
+        # New pages go in a new segment.
+        self._checkpoint_segments = state['segments']
+        self._checkpoint_pages = self.page_count
+        self._checkpoint_segment = None
+        self._resumed_pages = self.page_count
+
+        # The original objects will be added again, so skip the ones which
+        # have been placed.
+        self._skip_labels = self.label_count
+        return self._skip_labels
+
+    def save_shards(self, filename, pages_per_shard, manifest=None, workers=1, changed_only=False):
+        """Save the sheet as a series of PDF files, each holding a fixed number
+        of pages.
+
+        Parameters
+        ----------
+        filename: string
+            The filename for each shard. This is formatted with the number of
+            the shard (starting at 1) through str.format(), e.g.,
+            'labels-{0:03d}.pdf'. Any existing files will be overwritten.
+        pages_per_shard: positive integer
+            The maximum number of pages in each shard. All shards except the
+            last will have exactly this many pages.
+        manifest: path, default None
+            If given, the manifest (see below) is saved to this filename as
+            JSON.
+        workers: positive integer, default 1
+            The number of shards to save at the same time. As all the labels
+            have already been placed, each shard can be rendered independently
+            of the others in a forked worker process. Progress reports from
+            different shards may then be interleaved, and instrumentation and
+            cancellation only apply to the shards saved in this process. On
+            platforms without fork, the shards are saved one at a time.
+        changed_only: Boolean, default False
+            Only save the shards containing pages changed by update_label since
+            the last call to this method. The other shards are assumed to have
+            been saved by a previous call with the same filename and
+            pages_per_shard, and are left as they are.
+
+        Returns
+        -------
+        The manifest, a dictionary with the total number of 'pages' and
+        'labels' in the sheet, and a 'shards' list with a dictionary for each
+        shard giving its 'filename', 'first_page' and 'last_page', and
+        'first_label' and 'last_label' (numbered from 1 in the order they were
+        added, or None if the shard has no labels).
 
         """
-        # Shade any remaining missing labels if desired.
+        # Check the size is valid.
+        pages_per_shard = int(pages_per_shard)
+        if pages_per_shard < 1:
+            raise ValueError("There must be at least one page per shard.")
+
+        # Shade any remaining missing labels if desired. This has to be done
+        # before any of the shards are saved as it changes the current page.
+        self.close_checkpoint()
         self._shade_remaining_missing()
 
-        # Create a canvas.
+        # Work out what goes in each shard.
+        shards = []
+        for first in range(1, self.page_count + 1, pages_per_shard):
+            last = min(first + pages_per_shard - 1, self.page_count)
+            first_label, last_label = self._page_labels(first)[0], self._page_labels(last)[1]
+            if first_label > last_label:
+                first_label, last_label = None, None
+            shards.append({
+                'filename': filename.format(len(shards) + 1),
+                'first_page': first,
+                'last_page': last,
+                'first_label': first_label,
+                'last_label': last_label,
+            })
+
+        # Pick which ones need to be saved.
+        if changed_only:
+            pending = [shard for shard in shards
+                       if any(shard['first_page'] <= page <= shard['last_page'] for page in self._changed_pages)]
+        else:
+            pending = shards
+
+        # Save them. ReportLab's renderers modify the drawings while rendering
+        # them, so the shards can't be rendered in threads. Forked processes
+        # inherit the sheet from the pool initializer without it having to be
+        # pickled.
+        context = _fork_context()
+        if workers > 1 and len(pending) > 1 and context:
+            pool = context.Pool(min(workers, len(pending)), initializer=_init_shard_worker, initargs=(self,))
+            try:
+                pool.map(_save_shard, [(s['filename'], s['first_page'], s['last_page']) for s in pending])
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for shard in pending:
+                self._save_pages(shard['filename'], shard['first_page'], shard['last_page'])
+        self._changed_pages.clear()
+
+        # Create the manifest.
+        result = {'pages': self.page_count, 'labels': self.label_count, 'shards': shards}
+        if manifest:
+            with open(manifest, 'w') as f:
+                json.dump(result, f, indent=2)
+        return result
+
+    def _page_labels(self, page):
+        """Helper method to get the numbers of the first and last labels on a
+        page. Not intended for external use.
+
+        Labels are numbered from 1 in the order they were added. If the page
+        has no labels, the first number will be greater than the last.
+
+        """
+        first = self._page_starts[page - 1] + 1
+        if page < self.page_count:
+            last = self._page_starts[page]
+        else:
+            last = self.label_count
+        return first, last
+
+    def _save_pages(self, filelike, first, last, others=(), stream=False):
+        """Helper method to save a range of pages to a PDF. Not intended for
+        external use.
+
+        Parameters
+        ----------
+        filelike: path or file-like object
+            Where to save the PDF.
+        first, last: positive integers
+            The (inclusive) range of pages to save.
+        others: list of labels.Sheet instances
+            Other sheets whose pages are added after the range.
+        stream: Boolean, default False
+            Whether to write each page as soon as it is rendered.
+
+        """
+        # Streaming to a filename needs the file open the whole time.
+        if stream and not hasattr(filelike, 'write'):
+            with open(filelike, 'wb') as f:
+                self._save_pages(f, first, last, others, stream)
+            return
+        for done in self._iter_save(filelike, first, last, others, stream):
+            pass
+
+    def _iter_save(self, filelike, first, last, others=(), stream=False):
+        """Generator which saves a range of pages to a PDF, yielding after each
+        page is rendered. Not intended for external use.
+
+        The parameters are the same as for _save_pages, except that a file-like
+        object must be given when streaming.
+
+        """
+        from reportlab.pdfgen.canvas import Canvas
+        from reportlab.graphics.renderbase import renderScaledDrawing
+
+        # Count the bytes written to a file-like object as they go past.
+        instrumentation = self.instrumentation
+        progress = self.progress
+        if (instrumentation or progress) and hasattr(filelike, 'write'):
+            filelike = CountingWriter(filelike)
+
+        # Create a canvas, and renderers which embed each registered image
+        # once.
         canvas = Canvas(filelike, pagesize=self._pagesize)
+        streamer = None
+        if stream:
+            from .streaming import PageStreamer
+            streamer = PageStreamer(canvas, filelike)
+        renderers = {}
+        for sheet in (self,) + tuple(others):
+            if id(sheet.images) not in renderers:
+                renderers[id(sheet.images)] = (sheet.images, pdf_renderer(sheet.images))
+
+        # Gather the pages along with the renderer for each.
+        pages = [(page, renderers[id(self.images)][1]) for page in self._pages[first-1:last]]
+        total = self.page_count
+        for sheet in others:
+            sheet._shade_remaining_missing()
+            pages.extend((page, renderers[id(sheet.images)][1]) for page in sheet._pages)
+            total += sheet.page_count
+
+        # Find out how many times each page composition is used.
+        keys = [self._page_key(page) for page, renderer in pages]
+        uses = Counter(keys)
+        forms = {}
 
         # Render each created page onto the canvas.
-        for page in self._pages:
-            renderPDF.draw(page, canvas, 0, 0)
-            canvas.showPage()
+        for number, ((page, renderer), key) in enumerate(zip(pages, keys), first):
+            if self.cancel:
+                self.cancel.check()
+            if instrumentation:
+                started = instrumentation.start()
+
+            # Unique pages are rendered directly.
+            if uses[key] == 1:
+                renderer.draw(renderScaledDrawing(page), canvas, 0, 0)
+
+            # Repeated pages are rendered into a form the first time they are
+            # seen, and then the form is used for all of them.
+            else:
+                name = forms.get(key)
+                if name is None:
+                    name = 'pylabels_page{0:d}'.format(len(forms) + 1)
+                    canvas.beginForm(name)
+                    renderer.draw(renderScaledDrawing(page), canvas, 0, 0)
+                    canvas.endForm()
+                    forms[key] = name
+                canvas.doForm(name)
 
-        # Done.
+            canvas.showPage()
+            if streamer:
+                streamer.flush()
+            if instrumentation:
+                instrumentation.stop('render', started)
+            if progress:
+                progress.report('rendered', number, total, force=(number == total))
+
+                # When streaming, the data for each page is written straight
+                # away, so the total so far can be reported.
+                if streamer:
+                    progress.report('written', filelike.count)
+            yield number
+
+        # Add the registered images which were used.
+        for images, renderer in renderers.values():
+            images.define_forms(canvas, renderer.used)
+
+        # Write the file, noting its size if it was saved under a filename.
+        if instrumentation:
+            started = instrumentation.start()
         canvas.save()
+        if instrumentation:
+            instrumentation.stop('write', started)
+        if instrumentation or progress:
+            if hasattr(filelike, 'write'):
+                written = filelike.count
+            else:
+                written = os.path.getsize(filelike)
+            if instrumentation:
+                instrumentation.add_bytes(written)
+            if progress:
+                progress.report('written', written, written, force=True)
 
     def preview(self, page, filelike, format='png', dpi=72, background_colour=0xFFFFFF):
         """Render a preview image of a page.
@@ -528,29 +1773,20 @@ class Sheet(object):
             If the page number is not valid.
 
         """
+        from reportlab.graphics import renderPM
+
         # Check the page number.
         if page < 1 or page > self.page_count:
             raise ValueError("Invalid page number; should be between 1 and {0:d}.".format(self.page_count))
 
-        # Shade any remaining missing labels if desired.
-        self._shade_remaining_missing()
-
-        # Rendering to an image (as opposed to a PDF) requires any background
-        # to have an integer width and height if it is a ReportLab Image
-        # object. Drawing objects are exempt from this.
-        oldw, oldh = None, None
-        if isinstance(self._bgimage, Image):
-            oldw, oldh = self._bgimage.width, self._bgimage.height
-            self._bgimage.width = int(oldw) + 1
-            self._bgimage.height = int(oldh) + 1
-
-        # Let ReportLab do the heavy lifting.
-        renderPM.drawToFile(self._pages[page-1], filelike, format, dpi, background_colour)
-
-        # Restore the size of the background image if we changed it.
-        if oldw:
-            self._bgimage.width = oldw
-            self._bgimage.height = oldh
+        # Let ReportLab do the heavy lifting on a copy of the page, which has
+        # any remaining missing labels shaded. This does not change the sheet,
+        # so pages can be previewed from several threads at once.
+        if self.instrumentation:
+            started = self.instrumentation.start()
+        renderPM.drawToFile(self._image_page(page), filelike, format, dpi, background_colour)
+        if self.instrumentation:
+            self.instrumentation.stop('preview', started)
 
     def preview_string(self, page, format='png', dpi=72, background_colour=0xFFFFFF):
         """Render a preview image of a page as a string.
@@ -582,29 +1818,247 @@ class Sheet(object):
             If the page number is not valid.
 
         """
+        from reportlab.graphics import renderPM
+
         # Check the page number.
         if page < 1 or page > self.page_count:
             raise ValueError("Invalid page number; should be between 1 and {0:d}.".format(self.page_count))
 
-        # Shade any remaining missing labels if desired.
-        self._shade_remaining_missing()
+        # Let ReportLab do the heavy lifting on a copy of the page, which has
+        # any remaining missing labels shaded. This does not change the sheet,
+        # so pages can be previewed from several threads at once.
+        if self.instrumentation:
+            started = self.instrumentation.start()
+        s = renderPM.drawToString(self._image_page(page), format, dpi, background_colour)
+        if self.instrumentation:
+            self.instrumentation.stop('preview', started)
 
-        # Rendering to an image (as opposed to a PDF) requires any background
-        # to have an integer width and height if it is a ReportLab Image
-        # object. Drawing objects are exempt from this.
-        oldw, oldh = None, None
-        if isinstance(self._bgimage, Image):
-            oldw, oldh = self._bgimage.width, self._bgimage.height
-            self._bgimage.width = int(oldw) + 1
-            self._bgimage.height = int(oldh) + 1
+        # Done.
+        return s
 
-        # Let ReportLab do the heavy lifting.
-        s = renderPM.drawToString(self._pages[page-1], format, dpi, background_colour)
+    def raster(self, dpi=203, mode='1', threshold=128, dither=False, pages=None, background_colour=0xFFFFFF):
+        """Generator which renders each page to raster data for a printer.
 
-        # Restore the size of the background image if we changed it.
-        if oldw:
-            self._bgimage.width = oldw
-            self._bgimage.height = oldh
+        Only one page is held in memory at a time, so this can be used to
+        stream the pages to a printer as they are rendered.
 
-        # Done.
-        return s
+        Parameters
+        ----------
+        dpi: positive real, default 203
+            The resolution of the printer in dots-per-inch.
+        mode: '1' or 'L', default '1'
+            '1' gives one bit per pixel packed eight to a byte, most
+            significant bit first, with a set bit for a black dot and each row
+            padded to a whole number of bytes. 'L' gives one byte per pixel
+            (0 is black, 255 is white).
+        threshold: integer in [0, 255], default 128
+            For mode '1', grey levels below this are printed as black.
+        dither: Boolean, default False
+            For mode '1', use Floyd-Steinberg dithering instead of the
+            threshold.
+        pages: iterable of positive integers, default None
+            The pages to render, in the order to render them. If None, every
+            page is rendered.
+        background_colour: Hex colour specification
+            What color background to use.
+
+        Yields
+        ------
+        A tuple (page, width, height, data) for each page, with the width and
+        height in pixels and the data as a byte string of rows from the top of
+        the page down.
+
+        Raises
+        ------
+        ValueError:
+            If the mode or a page number is not valid.
+
+        """
+        from reportlab.graphics import renderPM
+        from PIL import Image as PILImage
+
+        # Check the parameters.
+        if mode not in ('1', 'L'):
+            raise ValueError("Raster mode must be '1' or 'L'.")
+        if pages is None:
+            pages = range(1, self.page_count + 1)
+        pages = list(pages)
+        for page in pages:
+            if page < 1 or page > self.page_count:
+                raise ValueError("Invalid page number; should be between 1 and {0:d}.".format(self.page_count))
+        table = [0 if value < threshold else 255 for value in range(256)]
+
+        # Consecutive pages with the same content reuse the previous raster.
+        # As with previews, each page is rendered from a copy; the last page
+        # may have extra missing labels shaded in its copy, so it never reuses
+        # the raster of the page before.
+        last_key, last = None, None
+        for count, page in enumerate(pages, 1):
+            if self.cancel:
+                self.cancel.check()
+            key = (self._page_key(self._pages[page-1]), page == self.page_count)
+            if key != last_key:
+                if self.instrumentation:
+                    started = self.instrumentation.start()
+                image = renderPM.drawToPIL(self._image_page(page), dpi, background_colour).convert('L')
+                if mode == 'L':
+                    data = image.tobytes()
+                elif dither:
+                    data = image.convert('1', dither=PILImage.FLOYDSTEINBERG).tobytes('raw', '1;I')
+                else:
+                    data = image.point(table, '1').tobytes('raw', '1;I')
+                last_key, last = key, (image.size[0], image.size[1], data)
+                del image
+                if self.instrumentation:
+                    self.instrumentation.stop('raster', started)
+            if self.progress:
+                self.progress.report('rendered', count, len(pages), force=(count == len(pages)))
+            yield (page,) + last
+
+    def save_raster(self, filelike, dpi=203, mode='1', threshold=128, dither=False, pages=None,
+                    background_colour=0xFFFFFF):
+        """Save the raster data of each page, one after another, to a file.
+
+        The parameters are the same as for the raster() method, apart from
+        filelike which can be a filename or a file-like object opened for
+        writing bytes. Nothing is written between pages.
+
+        Returns
+        -------
+        A list of the (page, width, height) of each page written.
+
+        """
+        close = False
+        if not hasattr(filelike, 'write'):
+            filelike = open(filelike, 'wb')
+            close = True
+        written = []
+        try:
+            for page, width, height, data in self.raster(dpi, mode, threshold, dither, pages, background_colour):
+                filelike.write(data)
+                written.append((page, width, height))
+        finally:
+            if close:
+                filelike.close()
+        return written
+
+    def export_labels(self, objects, destination, format='png', dpi=72, background_colour=0xFFFFFF,
+                      filename='label-{0:05d}.{1}', workers=1, batch_size=100):
+        """Export the label for each object as a separate image.
+
+        Each distinct label is drawn and rendered once, including the padding,
+        clipping and any border, and saved to a directory or a zip file along
+        with a manifest.json file mapping the objects to the images. Labels are
+        identified by the cache_key function given to the sheet, so objects
+        with the same key share an image. The labels are not added to the
+        sheet, and are drawn with the drawing function of the sheet (not any
+        batch callable given to add_labels).
+
+        Parameters
+        ----------
+        objects: iterable
+            The objects to export. If this is a generator it will be consumed.
+            Only one batch of labels is held in memory at a time.
+        destination: path or file-like object
+            A directory to save the images in (created if needed), or a zip
+            file to save them to. A path ending in .zip or a file-like object
+            opened for writing bytes is treated as a zip file.
+        format: string, default 'png'
+            The image format, e.g., 'png' or 'tiff'. Any format supported by
+            PIL can be used.
+        dpi: positive real, default 72
+            The dots-per-inch to use when rendering.
+        background_colour: Hex colour specification
+            What color background to use.
+        filename: string, default 'label-{0:05d}.{1}'
+            The name of each image, formatted with the number of the image
+            (starting at 1) and the format through str.format().
+        workers: positive integer, default 1
+            The number of processes to render the images in. With more than
+            one, each label is pickled to send it to a worker, so everything
+            the drawing function adds to the labels must be picklable.
+        batch_size: positive integer, default 100
+            The number of distinct labels drawn before they are rendered.
+
+        Returns
+        -------
+        The manifest, a dictionary with the 'format' and 'dpi', a 'files'
+        dictionary mapping the key of each distinct label to its image, and an
+        'objects' list giving the key and image of each object in order.
+
+        """
+        import zipfile
+
+        # Open the destination. Paths may be given as path objects (e.g.,
+        # pathlib.Path) rather than strings.
+        archive = None
+        if not hasattr(destination, 'write') and hasattr(os, 'fspath'):
+            destination = os.fspath(destination)
+        if hasattr(destination, 'write') or destination.lower().endswith('.zip'):
+            archive = zipfile.ZipFile(destination, 'w', zipfile.ZIP_STORED)
+        elif not os.path.isdir(destination):
+            os.makedirs(destination)
+
+        def save(name, data):
+            if archive:
+                archive.writestr(name, data)
+            else:
+                with open(os.path.join(destination, name), 'wb') as f:
+                    f.write(data)
+
+        # Start the worker processes.
+        pool = None
+        mp_context = _fork_context()
+        if workers > 1:
+            import multiprocessing
+            pool = (mp_context or multiprocessing).Pool(workers)
+
+        try:
+            files = {}
+            entries = []
+            batch = []
+
+            # Render the pending labels and save the images.
+            def flush():
+                jobs = [(label, format, dpi, background_colour) for name, label in batch]
+                if pool:
+                    images = pool.map(_render_label, jobs)
+                else:
+                    images = [_render_label(job) for job in jobs]
+                for (name, label), image in zip(batch, images):
+                    save(name, image)
+                if self.progress:
+                    self.progress.report('exported', len(files))
+                del batch[:]
+
+            # Draw each distinct label once.
+            for obj in objects:
+                if self.cancel:
+                    self.cancel.check()
+                key = self.cache_key(obj)
+                name = files.get(key)
+                if name is None:
+                    name = filename.format(len(files) + 1, format.lower())
+                    files[key] = name
+                    context = LabelContext(len(entries) + 1, seed=self.seed) if self.context else None
+                    batch.append((name, self._create_label(obj, context)))
+                    if len(batch) >= batch_size:
+                        flush()
+                entries.append({'key': key, 'filename': name})
+            if batch:
+                flush()
+            if self.progress:
+                self.progress.report('exported', len(files), len(files), force=True)
+
+            # And the manifest.
+            manifest = {'format': format, 'dpi': dpi, 'files': files, 'objects': entries}
+            save('manifest.json', json.dumps(manifest, indent=2).encode('utf-8'))
+
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+            if archive:
+                archive.close()
+
+        return manifest
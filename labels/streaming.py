@@ -0,0 +1,168 @@
+# This file is part of pylabels, a Python library to create PDFs for printing
+# labels.
+# Copyright (C) 2012, 2013, 2014, 2015 Blair Bonnett
+#
+# pylabels is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# pylabels is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pylabels.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Incremental writing of ReportLab PDF documents.
+
+ReportLab keeps everything for a document in memory and formats the whole file
+when the canvas is saved. The content stream of each page, which is most of
+the file for a sheet of labels, is complete as soon as the page is shown
+though, and objects in a PDF can appear in any order as long as the
+cross-reference table at the end gives their offsets. A PageStreamer writes
+the header and the content stream of each page to the output as soon as the
+page is finished, and then writes the remaining objects, the cross-reference
+table and the trailer when the canvas is saved.
+
+This relies on the internals of the ReportLab document classes. It is not
+intended for external use.
+
+"""
+
+from reportlab import rl_config
+from reportlab.pdfbase import pdfdoc
+
+
+class ChunkBuffer(object):
+    """File-like object which collects the data written to it until it is
+    taken.
+
+    """
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(data)
+
+    def take(self):
+        """Get and clear the data written so far. """
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+class StreamingFile(pdfdoc.PDFFile):
+    """PDF file accumulator which writes to the output as it goes rather than
+    holding the file in memory.
+
+    """
+    def __init__(self, output, pdfVersion=pdfdoc.PDF_VERSION_DEFAULT):
+        pdfdoc.PDFFile.__init__(self, pdfVersion)
+
+        # The header has been added to the strings; write it out and send
+        # everything else straight to the output.
+        output.write(b''.join(self.strings))
+        self.strings = []
+        self.write = output.write
+
+
+class PageStreamer(object):
+    """Write the pages of a canvas to an output as they are finished.
+
+    The output must be the file-like object the canvas was created with, as
+    the final part of the file is written when the canvas is saved. Call
+    flush() after each showPage() to write the finished page.
+
+    """
+    def __init__(self, canvas, output):
+        doc = canvas._doc
+        self.doc = doc
+        doc.encrypt.prepare(doc)
+        self.file = StreamingFile(output, doc._pdfVersion)
+        self.written = {}
+        self.flushed = 0
+
+        # Saving the canvas formats the document; do that through this object
+        # so that only the objects which have not been written are formatted.
+        doc.format = self.format
+
+    def flush(self):
+        """Write the content streams of any pages finished since the last
+        call.
+
+        """
+        doc = self.doc
+        pages = doc.Pages.pages
+        for page in pages[self.flushed:]:
+            stream = page.stream
+            if page.Contents or not stream:
+                continue
+
+            # Create the content stream as the page would when it is formatted.
+            S = pdfdoc.PDFStream()
+            if page.compression:
+                S.filters = rl_config.useA85 and [pdfdoc.PDFBase85Encode, pdfdoc.PDFZCompress] or [pdfdoc.PDFZCompress]
+            S.content = stream
+            S.__Comment__ = "page stream"
+
+            # Give it an object number and write it out. The page then just
+            # refers to it, and the content can be freed.
+            reference = doc.Reference(S)
+            name = reference.name
+            self.written[name] = self.file.add(pdfdoc.PDFIndirectObject(name, S).format(doc))
+            doc.idToObject[name] = None
+            page.Contents = reference
+            page.stream = None
+        self.flushed = len(pages)
+
+    def format(self):
+        """Write the remainder of the document. This replaces the format method
+        of the document, and follows the same steps.
+
+        """
+        self.flush()
+        doc = self.doc
+        cat = doc.Catalog
+        info = doc.info
+        doc.Reference(cat)
+        doc.Reference(info)
+        encryptref = None
+        encryptinfo = doc.encrypt.info()
+        if encryptinfo:
+            encryptref = doc.Reference(encryptinfo)
+
+        # Write every object which has not already been written. New objects
+        # can be registered while formatting.
+        File = doc.__accum__ = self.file
+        counter = 0
+        ids = []
+        while True:
+            counter += 1
+            if counter not in doc.numberToId:
+                break
+            oid = doc.numberToId[counter]
+            if oid in self.written:
+                doc.idToOffset[oid] = self.written[oid]
+            else:
+                doc.idToOffset[oid] = File.add(pdfdoc.PDFIndirectObject(oid, doc.idToObject[oid]).format(doc))
+            ids.append(oid)
+        del doc.__accum__
+
+        # Then the cross-reference table and the trailer.
+        xref = pdfdoc.PDFCrossReferenceTable()
+        xref.addsection(0, ids)
+        xrefoffset = File.add(xref.format(doc))
+        trailer = pdfdoc.PDFTrailer(
+            startxref=xrefoffset,
+            Size=len(doc.numberToId) + 1,
+            Root=doc.Reference(cat),
+            Info=doc.Reference(info),
+            Encrypt=encryptref,
+            ID=doc.ID(),
+        )
+        File.add(trailer.format(doc))
+
+        # Everything has been written, so there is nothing for the canvas to
+        # write itself.
+        return b''
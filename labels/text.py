@@ -0,0 +1,282 @@
+# This file is part of pylabels, a Python library to create PDFs for printing
+# labels.
+# Copyright (C) 2012, 2013, 2014, 2015 Blair Bonnett
+#
+# pylabels is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# pylabels is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pylabels.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Helpers to fit text into the space available on a label.
+
+The width of a string is the sum of the advances of its characters, which are
+proportional to the font size. The advance of each character at a font size of
+one is looked up once per font and stored, so measuring a string afterwards
+needs no calls into ReportLab. The results of fitting are also remembered, so
+fitting the same text again (e.g., a name which appears on several labels) is
+just a dictionary lookup.
+
+"""
+
+from collections import OrderedDict
+import threading
+
+# Advances of the characters of each font at a font size of one, keyed by the
+# font name and then the character.
+_advances = {}
+
+# Vertical extent of each font (ascent minus descent) at a font size of one.
+_extents = {}
+
+
+class _LRUCache(object):
+    """Dictionary-like cache which discards the least recently used entries
+    once it is full. Not intended for external use.
+
+    """
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is not None:
+                self._entries[key] = value
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Results of the fitting functions.
+_fitted = _LRUCache()
+
+
+def text_width(text, font_name, font_size=1):
+    """Measure the width of a string.
+
+    This gives the same result as ReportLab's stringWidth function, but looks
+    up the advance of each character from a table built up as it is used.
+
+    Parameters
+    ----------
+    text: string
+        The text to measure.
+    font_name: string
+        The name of a standard or registered font.
+    font_size: positive real, default 1
+        The font size in points.
+
+    Returns
+    -------
+    The width in points.
+
+    """
+    advances = _advances.get(font_name)
+    if advances is None:
+        advances = _advances.setdefault(font_name, {})
+    width = 0.0
+    for char in text:
+        advance = advances.get(char)
+        if advance is None:
+            from reportlab.pdfbase.pdfmetrics import stringWidth
+            advance = advances[char] = stringWidth(char, font_name, 1000) / 1000.0
+        width += advance
+    return width * font_size
+
+
+def _font_extent(font_name):
+    """Get the height of a font (its ascent minus its descent) at a font size
+    of one. Not intended for external use.
+
+    """
+    extent = _extents.get(font_name)
+    if extent is None:
+        from reportlab.pdfbase.pdfmetrics import getAscentDescent
+        ascent, descent = getAscentDescent(font_name, 1000)
+        extent = _extents[font_name] = (ascent - descent) / 1000.0
+    return extent
+
+
+def fit_font_size(text, font_name, width, height=None, max_size=None, min_size=0):
+    """Find the largest font size at which a single line of text fits.
+
+    Parameters
+    ----------
+    text: string
+        The text to fit.
+    font_name: string
+        The name of a standard or registered font.
+    width: positive real
+        The available width in points.
+    height: positive real, default None
+        The available height in points. The height of the font (its ascent
+        plus its descent) must fit in this. If None, only the width is used.
+    max_size: positive real, default None
+        The largest font size to return.
+    min_size: non-negative real, default 0
+        The smallest font size to return. The text may not fit at this size.
+
+    Returns
+    -------
+    The font size in points.
+
+    """
+    key = ('size', text, font_name, width, height, max_size, min_size)
+    size = _fitted.get(key)
+    if size is not None:
+        return size
+
+    # As the width is proportional to the font size, the largest size which
+    # fits can be calculated directly.
+    sizes = []
+    unit_width = text_width(text, font_name)
+    if unit_width:
+        sizes.append(width / unit_width)
+    if height is not None:
+        sizes.append(height / _font_extent(font_name))
+    if max_size is not None:
+        sizes.append(max_size)
+    if not sizes:
+        raise ValueError("Cannot fit empty text without a height or maximum size.")
+    size = max(min(sizes), min_size)
+
+    # Done.
+    _fitted.put(key, size)
+    return size
+
+
+def wrap_text(text, font_name, font_size, width):
+    """Split text into lines which fit in the given width.
+
+    The text is split at whitespace and words are added to each line while
+    they fit. A word which is wider than the available width on its own is
+    put on a line by itself.
+
+    Parameters
+    ----------
+    text: string
+        The text to wrap.
+    font_name: string
+        The name of a standard or registered font.
+    font_size: positive real
+        The font size in points.
+    width: positive real
+        The available width in points.
+
+    Returns
+    -------
+    A list of the lines.
+
+    """
+    limit = width / float(font_size)
+    space = text_width(' ', font_name)
+    lines = []
+    line, line_width = [], 0.0
+    for word in text.split():
+        word_width = text_width(word, font_name)
+        if line and line_width + space + word_width > limit:
+            lines.append(' '.join(line))
+            line, line_width = [], 0.0
+        if line:
+            line_width += space
+        line.append(word)
+        line_width += word_width
+    if line:
+        lines.append(' '.join(line))
+    return lines
+
+
+def fit_text(text, font_name, width, height, max_size, min_size=1, leading=1.2, precision=0.1):
+    """Find the largest font size at which text fits when wrapped onto as many
+    lines as needed.
+
+    A binary search is used to find the font size, with the text wrapped by
+    wrap_text at each size tried.
+
+    Parameters
+    ----------
+    text: string
+        The text to fit.
+    font_name: string
+        The name of a standard or registered font.
+    width, height: positive reals
+        The available space in points.
+    max_size: positive real
+        The largest font size to try.
+    min_size: positive real, default 1
+        The smallest font size to try. If the text does not fit at this size,
+        this size is returned anyway.
+    leading: positive real, default 1.2
+        The distance between the baselines of the lines as a multiple of the
+        font size.
+    precision: positive real, default 0.1
+        The search stops once the font size is known to within this many
+        points.
+
+    Returns
+    -------
+    A tuple of the font size and the list of lines.
+
+    """
+    key = ('text', text, font_name, width, height, max_size, min_size, leading, precision)
+    result = _fitted.get(key)
+    if result is not None:
+        return result[0], list(result[1])
+
+    def fits(size):
+        lines = wrap_text(text, font_name, size, width)
+        if any(text_width(line, font_name, size) > width for line in lines):
+            return None
+        if size * (_font_extent(font_name) + leading * (len(lines) - 1)) > height:
+            return None
+        return lines
+
+    # Search between the smallest size and the largest.
+    lines = fits(max_size)
+    if lines is not None:
+        size = max_size
+    else:
+        low, high = float(min_size), float(max_size)
+        lines = fits(low) or wrap_text(text, font_name, low, width)
+        while high - low > precision:
+            middle = (low + high) / 2.0
+            attempt = fits(middle)
+            if attempt is None:
+                high = middle
+            else:
+                low, lines = middle, attempt
+        size = low
+
+    # Done.
+    _fitted.put(key, (size, tuple(lines)))
+    return size, lines
+
+
+def clear_cache():
+    """Forget the stored character advances and fitting results.
+
+    This is only needed if a font is registered again under the same name with
+    different metrics.
+
+    """
+    _advances.clear()
+    _extents.clear()
+    _fitted.clear()
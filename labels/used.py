@@ -0,0 +1,171 @@
+# This file is part of pylabels, a Python library to create PDFs for printing
+# labels.
+# Copyright (C) 2012, 2013, 2014, 2015 Blair Bonnett
+#
+# pylabels is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# pylabels is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# pylabels.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+
+
+class UsedLabels(object):
+    """Record of the labels already used on partially used pages.
+
+    The used labels on each page are stored as the bits of an integer, with
+    bit (row - 1) * columns + (column - 1) set if the label at that position
+    has been used. Looking up the next free label on a page is then a couple
+    of integer operations regardless of how many labels are used, and the
+    record is not changed as labels are placed.
+
+    """
+    def __init__(self, rows, columns):
+        """
+        Parameters
+        ----------
+        rows, columns: positive integers
+            The number of rows and columns of labels on each page.
+
+        """
+        self.rows = rows
+        self.columns = columns
+        self._full = (1 << (rows * columns)) - 1
+        self._masks = {}
+
+    def __contains__(self, page):
+        return bool(self._masks.get(page))
+
+    def __len__(self):
+        return len(self._masks)
+
+    def index(self, row, column):
+        """Get the index of a position, i.e., its bit in the mask of a page.
+
+        Raises
+        ------
+        IndexError:
+            If the row or column is not valid.
+
+        """
+        if row < 1 or row > self.rows:
+            raise IndexError("Invalid row number: {0:d}.".format(row))
+        if column < 1 or column > self.columns:
+            raise IndexError("Invalid column number: {0:d}.".format(column))
+        return (int(row) - 1) * self.columns + int(column) - 1
+
+    def position(self, index):
+        """Get the (row, column) position of an index. """
+        row, column = divmod(index, self.columns)
+        return row + 1, column + 1
+
+    def add(self, page, positions):
+        """Mark labels on a page as used.
+
+        Parameters
+        ----------
+        page: positive integer
+            The page number.
+        positions: iterable
+            An iterable of (row, column) pairs of the used labels.
+
+        Raises
+        ------
+        IndexError:
+            If any of the rows or columns are not valid.
+
+        """
+        mask = self._masks.get(page, 0)
+        for row, column in positions:
+            mask |= 1 << self.index(row, column)
+        if mask:
+            self._masks[page] = mask
+
+    def mask(self, page):
+        """Get the bitmask of the used labels on a page. """
+        return self._masks.get(page, 0)
+
+    def is_used(self, page, row, column):
+        """Check whether a label has been used. """
+        return bool(self._masks.get(page, 0) >> self.index(row, column) & 1)
+
+    def count(self, page):
+        """Get the number of used labels on a page. """
+        return bin(self._masks.get(page, 0)).count('1')
+
+    def next_free(self, page, index=0):
+        """Find the first free label on a page at or after an index.
+
+        Returns
+        -------
+        The index of the free label, or None if there are no free labels at or
+        after the given index.
+
+        """
+        free = (~self._masks.get(page, 0) & self._full) >> index
+        if not free:
+            return None
+        return index + (free & -free).bit_length() - 1
+
+    def pages(self):
+        """Get a sorted list of the pages with used labels. """
+        return sorted(self._masks)
+
+    def positions(self, page):
+        """Get a list of the (row, column) positions of the used labels on a
+        page, in order.
+
+        """
+        mask = self._masks.get(page, 0)
+        return [self.position(index) for index in range(self.rows * self.columns) if mask >> index & 1]
+
+    def free_positions(self, page):
+        """Get a list of the (row, column) positions of the free labels on a
+        page, in order.
+
+        """
+        mask = self._masks.get(page, 0)
+        return [self.position(index) for index in range(self.rows * self.columns) if not mask >> index & 1]
+
+    def copy(self):
+        """Create an independent copy of this record. """
+        other = UsedLabels(self.rows, self.columns)
+        other._masks = dict(self._masks)
+        return other
+
+    def as_dict(self):
+        """Get the used labels as a dictionary mapping page numbers to lists
+        of [row, column] pairs, e.g., for saving as JSON.
+
+        """
+        return dict((page, [list(position) for position in self.positions(page)]) for page in self.pages())
+
+    def load(self, filename):
+        """Mark the labels listed in a file as used.
+
+        This is intended for loading an inventory of partially used sheets. The
+        file is either JSON (if the filename ends in .json) mapping page
+        numbers to lists of [row, column] pairs, or CSV with page, row and
+        column columns (without a header).
+
+        """
+        with open(filename) as f:
+            if filename.endswith('.json'):
+                for page, positions in json.load(f).items():
+                    self.add(int(page), positions)
+            else:
+                import csv
+                pages = {}
+                for row in csv.reader(f):
+                    if row:
+                        page, r, c = (int(v) for v in row)
+                        pages.setdefault(page, []).append((r, c))
+                for page, positions in pages.items():
+                    self.add(page, positions)
@@ -13,6 +13,9 @@ setup(name='pylabels',
       author_email='blair.bonnett@gmail.com',
       url='https://github.com/bcbnz/pylabels/',
       packages=['labels',],
+      entry_points={
+          'console_scripts': ['pylabels = labels.cli:main', 'pylabels-server = labels.server:main'],
+      },
       requires=['reportlab'],
       provides=['pylabels'],
       license='GPLv3+',